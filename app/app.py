@@ -10,8 +10,10 @@ from routes.llm_config.models import LLMConfig
 from routes.industry import industry
 from routes.industry.models import populate_industries_from_mongo
 from routes.llm import llm
+from routes.llm.utils.retriever import retriever_pool
 from routes.auth import auth, session, bcrypt
 from routes.chat import chat
+from routes.chat.utils.models import create_indexes
 from routes.llm import llm
 from routes.llm_config import llmConf
 from config import ApplicationConfig
@@ -76,10 +78,13 @@ with app.app_context():
     session.init_app(app)
     db.init_app(app)             
     db.create_all()
+    create_indexes()
     
     # Initialize application data
     create_default_admin()
     populate_industries_from_mongo()
+    # Build the BM25 index of the hybrid and degraded retrieval in the background
+    retriever_pool.start()
     
     # Configure default LLM (Language Learning Model)
     LLMConfig.add_llm(
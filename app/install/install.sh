@@ -34,5 +34,10 @@ sleep 5
 
 # DATABASE
 echo -e "\e[1;34m[INFO]\e[0m Creating databases..."
-python3 create_dbs.py
+## Reuse the precomputed document vectors when an embedding snapshot is shipped
+if [ -d embeddings_snapshot ]; then
+    python3 create_dbs.py --snapshot embeddings_snapshot
+else
+    python3 create_dbs.py
+fi
 echo -e "\e[1;32m[SUCCESS]\e[0m Setup complete!"
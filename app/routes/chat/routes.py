@@ -1,12 +1,12 @@
 from typing import List
-import requests
-from flask import request, Response, current_app
+from flask import request, Response, current_app, stream_with_context
 from werkzeug.exceptions import ClientDisconnected
 
 from . import chat
 from .utils.token import token_required, verify_jwt
 from .utils.models import Chat, Message, Ticket
-from .utils.llm import LLMResponse, invoke_llm
+from .utils.llm import LLMResponse, invoke_llm, stream_llm
+from ..llm.utils.memory import MEMORY_WINDOW_SIZE
 
 
 
@@ -221,6 +221,95 @@ def list_msgs():
     return {'error': 0, 'message': 'Messages found', 'data': {'chat_id': chat.id, 'messages': message_list}}, 200
     
     
+def save_response(response_message: Message, response: LLMResponse) -> dict:
+    """
+    Save the response of the LLM and its references to the database.
+
+    Args:
+        response_message (Message): The pending model message to complete.
+        response (LLMResponse): The response of the LLM.
+
+    Returns:
+        dict: The message data returned to the client.
+    """
+    response_message.message = response.answer
+    tickets: List[Ticket] = [
+        Ticket(
+            message_id=response_message.id,
+            accident_id=ref['accident_id'],
+            event_type=ref['event_type'],
+            industry_type=ref['industry_type'],
+            title=ref['accident_title'],
+            url=ref['url'],
+            color=ref['color']
+        ) for ref in response.references
+    ]
+    for ticket in tickets:
+        ticket.save()    
+    response_message.tickets = tickets
+    response_message.save() 
+    
+    return {
+        'source': 'model',
+        'status': response_message.status,
+        'degraded': response.degraded,
+        'parts': {
+            'answer': response_message.message,
+            'references': [ticket.to_dict() for ticket in response_message.list_tickets()]
+            }
+    }
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Format a Server-Sent Event.
+
+    Args:
+        event (str): The event name.
+        data: The JSON serializable event data.
+
+    Returns:
+        str: The formatted event.
+    """
+    return f"event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+
+
+def stream_response(user_id: str, chat_id: str, message: str, history: list, industries: list, response_message: Message):
+    """
+    Stream the response of the LLM as Server-Sent Events.
+
+    Emits 'token' events with each part of the answer as the model generates it, a
+    'references' event once the whole JSON answer is parsed, then a 'done' event with
+    the saved message, formatted like the non-streaming response data.
+    """
+    response = None
+    try:
+        for kind, value in stream_llm(user_id, chat_id, message, history, industries):
+            if kind == 'token':
+                yield sse_event('token', {'text': value})
+            else:
+                response = value
+    except GeneratorExit:
+        # Client disconnected, do not leave the message pending
+        print("Client aborted the request.")
+        response_message.status = Message.STATUS_ERROR
+        save_response(response_message, LLMResponse(None, True, {'error': 1, 'message': 'Request aborted'}))
+        raise
+    except Exception as e:
+        print(f"Error while streaming response: {e}")
+        response = None
+    
+    if response is None:
+        response = LLMResponse(None, True, {'error': 1, 'message': 'Error 500'})
+    response_message.status = Message.STATUS_SUCCESS if response.is_valid() else Message.STATUS_ERROR
+    # Save the answer before the last events, the client may disconnect while they are sent
+    data = save_response(response_message, response)
+    if response.is_valid():
+        yield sse_event('references', {'references': response.references})
+    
+    yield sse_event('done', {'error': 0, 'message': 'Message sent', 'data': data})
+
+
 @chat.route('/send', methods=['POST'])
 @token_required
 def send():
@@ -229,6 +318,8 @@ def send():
 
     This route allows the user to send a new message in a specific chat. The message is then sent
     to the LLM for processing, and the response is saved and returned.
+    When 'stream' is true in the request body, the response is streamed as Server-Sent Events
+    (see stream_response).
     
     Returns:
         dict: JSON response containing the error code, message, and the model's response data.
@@ -255,8 +346,8 @@ def send():
         if industries is None:
             return {'error': 5, 'message': 'Industries are required', 'data': None}, 400
         
-        # Retrieve chat history
-        history = chat.history()
+        # Retrieve the last messages of the chat history, used to rebuild the LLM memory window
+        history = chat.history(limit=2 * MEMORY_WINDOW_SIZE)
         
         # Add message to chat database
         request_message: Message = Message(
@@ -272,6 +363,14 @@ def send():
         response_message = Message(user_id=user_id, chat_id=chat_id, message='', source=Message.SOURCE_MODEL, status=Message.STATUS_PENDING)
         chat.add_message(response_message)
         
+        # Stream the response
+        if request.json.get('stream', False):
+            return Response(
+                stream_with_context(stream_response(user_id, chat_id, message, history, industries, response_message)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
         # Invoke LLM
         try:
             response: LLMResponse = invoke_llm(user_id, chat_id, message, history, industries)
@@ -280,41 +379,15 @@ def send():
             else:
                 response_message.status = Message.STATUS_ERROR
         except Exception as e:
-            r = requests.Response()
-            r.status_code = 500
-            response = LLMResponse(r)
+            response = LLMResponse(None, True, {'error': 1, 'message': 'Error 500'})
             response_message.status = Message.STATUS_ERROR
             
             
         # Save response to database
-        response_message.message = response.answer
-        tickets: List[Ticket] = [
-            Ticket(
-                message_id=response_message.id,
-                accident_id=ref['accident_id'],
-                event_type=ref['event_type'],
-                industry_type=ref['industry_type'],
-                title=ref['accident_title'],
-                url=ref['url'],
-                color=ref['color']
-            ) for ref in response.references
-        ]
-        for ticket in tickets:
-            ticket.save()    
-        response_message.tickets = tickets
-        response_message.save() 
-        
         return {
             'error': 0, 
             'message': 'Message sent', 
-            'data': {
-                'source': 'model',
-                'status': response_message.status,
-                'parts': {
-                    'answer': response_message.message,
-                    'references': [ticket.to_dict() for ticket in response_message.list_tickets()]
-                    }
-            }
+            'data': save_response(response_message, response)
         }
     except ClientDisconnected as e:
         print("Client aborted the request (exception caught).")
@@ -1,7 +1,8 @@
 import logging
 from werkzeug.exceptions import ClientDisconnected
-import requests
-from flask import request
+
+from ...llm import service as llm_service
+from ...llm.utils.llm_exception_handler import LLMInvocationError
 
 
 class LLMResponse:
@@ -12,9 +13,11 @@ class LLMResponse:
         error (int): Represents the error status. Default is -1.
         answer (str): Contains the response answer from the LLM.
         references (list[dict]): Contains the references related to the response.
+        degraded (bool): Whether the answer was generated from a fallback context because the
+            vector store or the document database was unavailable.
     
     Methods:
-        __init__(response: requests.Response, is_bad_request: bool, bad_req_error_msg: dict):
+        __init__(response: dict, is_bad_request: bool, bad_req_error_msg: dict):
             Initializes the object, processes the response, and sets attributes accordingly.
         
         is_valid() -> bool:
@@ -26,13 +29,14 @@ class LLMResponse:
     error = -1
     answer: str = ''
     references: list[dict] = []
+    degraded: bool = False
     
-    def __init__(self, response: requests.Response, is_bad_request=False, bad_req_error_msg=None):
+    def __init__(self, response: dict, is_bad_request=False, bad_req_error_msg=None):
         """
         Initializes an instance of LLMResponse.
 
         Args:
-            response (requests.Response): The HTTP response object from the LLM.
+            response (dict): The answer returned by the LLM service.
             is_bad_request (bool): Flag indicating if the request was invalid.
             bad_req_error_msg (dict): A dictionary containing error information for a bad request.
         """
@@ -41,12 +45,7 @@ class LLMResponse:
             self.answer = bad_req_error_msg['message']
             return
         
-        if response.status_code != 200:
-            self.error = 1
-            self.answer = f'Error {response.status_code}'
-            return
-        
-        json_response = response.json()
+        json_response = response
         check = LLMResponse.check_response(json_response)
         if check['error'] != 0:
             self.error = check['error']
@@ -56,6 +55,7 @@ class LLMResponse:
         self.error = 0
         self.answer = json_response['answer']
         self.references = json_response['references']
+        self.degraded = bool(json_response.get('degraded', False))
 
     def is_valid(self) -> bool:
         """
@@ -78,6 +78,9 @@ class LLMResponse:
             dict: A dictionary indicating the validation result. Contains 'error' and 'message'.
         """
         error_string = 'It seems the LLM of your configuration did not succeed in making a well done response, please retry or ask for a better LLM. Error is : '
+        # response is a JSON object
+        if not isinstance(json_response, dict):
+            return {'error': 1, 'message': f'{error_string}Response is not a JSON object'}
         # response as 'answer' and 'references'
         if 'answer' not in json_response:
             return {'error': 1, 'message': f'{error_string}Missing answer field'}
@@ -130,39 +133,65 @@ def invoke_llm(user_id: str, chat_id: str, req_message: str, hist_message: list,
         if not industries or industries == []:
             error = {"error": 12, "message": "You don't have any industries affiliated, please contact your administrator to get you at least one."}
             return LLMResponse(None, True, error)
-        # Request to LLM
-        response = requests.post('http://localhost:5000/llm/invoke', json={
-            'user_id': user_id,
-            'chat_id': chat_id,
-            'history': hist_message, 
-            'question': req_message,
-            'industries': industries
-        })
-        
-        # Raise an exception if the request failed
-        response.raise_for_status()
-        return LLMResponse(response)
+        # Invoke the LLM in-process
+        payload = llm_service.build_payload(user_id, chat_id, req_message, hist_message, industries)
+        return LLMResponse(llm_service.invoke(payload))
 
     except ClientDisconnected as e:
         print("Client aborted the request.")
         raise
     
-    except requests.exceptions.HTTPError as e:
+    except LLMInvocationError as e:
         logging.error(f'Error while invoking LLM : {e}')
-        if response.status_code == 401:
-            return LLMResponse(None, True, {"error": 13, "message": "Your credentials for the selected LLM configuration are incorrect. Please ask an administrator to correct them."})
-        elif response.status_code == 404:
-            return LLMResponse(None, True, {"error": 14, "message": "Your URI for the selected LLM configuration is incorrect. Please ask an administrator to correct it."})
-        elif response.status_code == 400:
-            return LLMResponse(None, True, {"error": 15, "message": "The model name for the selected LLM configuration is incorrect. Please ask an administrator to correct it."})
-    except requests.exceptions.RequestException as e:
-        print(f"Error while invoking LLM: {e}")
-        # Return a fake response
-        r = requests.Response()
-        r.status_code = 500
-        return LLMResponse(r)
+        return LLMResponse(None, True, llm_error_message(e.error_code))
 
 
+def stream_llm(user_id: str, chat_id: str, req_message: str, hist_message: list, industries: list):
+    """
+    Invokes the Language Learning Model (LLM) like `invoke_llm`, streaming the answer.
 
+    Args:
+        user_id (str): The ID of the user making the request.
+        chat_id (str): The ID of the chat.
+        req_message (str): The question or message being sent to the LLM.
+        hist_message (list): A list of historical messages in the conversation.
+        industries (list): A list of industries associated with the user.
 
+    Yields:
+        tuple: ('token', str) for each part of the answer as it is generated, then
+        ('response', LLMResponse) once the whole response is available.
+    """
+    if not industries or industries == []:
+        error = {"error": 12, "message": "You don't have any industries affiliated, please contact your administrator to get you at least one."}
+        yield 'response', LLMResponse(None, True, error)
+        return
+    
+    try:
+        payload = llm_service.build_payload(user_id, chat_id, req_message, hist_message, industries)
+        for event in llm_service.stream(payload):
+            if event['type'] == 'token':
+                yield 'token', event['text']
+            elif event['type'] == 'result':
+                yield 'response', LLMResponse(event['result'])
+    except LLMInvocationError as e:
+        logging.error(f'Error while streaming LLM : {e}')
+        yield 'response', LLMResponse(None, True, llm_error_message(e.error_code))
+
+
+def llm_error_message(error_code: int) -> dict:
+    """
+    Builds the error returned to the user for a failed LLM invocation.
 
+    Args:
+        error_code (int): The HTTP-like error code of the LLMInvocationError.
+
+    Returns:
+        dict: A dictionary containing 'error' and 'message'.
+    """
+    if error_code == 401:
+        return {"error": 13, "message": "Your credentials for the selected LLM configuration are incorrect. Please ask an administrator to correct them."}
+    elif error_code == 404:
+        return {"error": 14, "message": "Your URI for the selected LLM configuration is incorrect. Please ask an administrator to correct it."}
+    elif error_code == 400:
+        return {"error": 15, "message": "The model name for the selected LLM configuration is incorrect. Please ask an administrator to correct it."}
+    return {"error": 1, "message": f"Error {error_code}"}
@@ -70,6 +70,8 @@ class Message(db.Model):
     STATUS_SUCCESS = 1   # Successfully processed
     
     __tablename__ = 'messages'
+    # Index used to fetch the last messages of a chat (see Chat.history)
+    __table_args__ = (db.Index('ix_messages_chat_id_created_at', 'chat_id', 'created_at'),)
     
     # Primary fields
     id = db.Column(db.String(32), primary_key=True, unique=True, default=get_uuid)
@@ -201,14 +203,21 @@ class Chat(db.Model):
         db.session.commit()
         return True
     
-    def history(self):
+    def history(self, limit: int = None):
         """
         Get chat history formatted for model context.
-        Returns list of message dictionaries with role and content.
+        Returns list of message dictionaries with role and content, oldest first.
+        When limit is given, only the last `limit` messages are fetched.
         """
+        if limit is None:
+            messages = self.messages()
+        else:
+            messages = Message.query.filter_by(user_id=self.user_id, chat_id=self.id) \
+                .order_by(Message.created_at.desc()).limit(limit).all()
+            messages.reverse()
         return [
             {'role': 'user' if message.source else 'model', 'parts': message.message}
-            for message in self.messages()
+            for message in messages
         ]
         
     def last_updated(self):
@@ -228,4 +237,13 @@ class Chat(db.Model):
             'name': self.name,
             'created_at': int(self.created_at.timestamp() * 1000) if self.created_at else None,
             'modified_at': int(self.last_updated().timestamp() * 1000) if self.last_updated() else None,
-        }
\ No newline at end of file
+        }
+
+
+def create_indexes():
+    """
+    Create the indexes missing from existing tables, db.create_all only creates them with new tables.
+    Must be called within an application context.
+    """
+    for index in Message.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
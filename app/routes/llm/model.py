@@ -1,8 +1,13 @@
+import asyncio
+import contextlib
 import logging
+import os
 import re
 import json
+import httpx
+from threading import Lock
 from langchain_openai.chat_models import ChatOpenAI
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableBranch, RunnablePassthrough, RunnableLambda
 from langchain_core.callbacks import AsyncCallbackManager, AsyncCallbackHandler
 from langchain_core.output_parsers import StrOutputParser
 from operator import itemgetter
@@ -12,10 +17,25 @@ from openai import APIConnectionError
 from openai import NotFoundError
 
 
+from .utils.answer_cache import answer_cache
+from .utils.answer_stream import AnswerStreamParser
 from .utils.llm_exception_handler import LLMInvocationError
 from .utils.memory import MemoryManager
 from .utils.prompts import CONTEXT_PROMPT, SYSTEM_PROMPT
-from .utils.retriever import retrieve
+from .utils.embedding_cache import normalize_text
+from .utils.event_loop import background_loop, offload
+from .utils.retriever import aquestion_similarity, aretrieve, embeddings, retrieve
+
+# Connection pool settings of the HTTP client used to reach the LLM provider
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 120))
+
+# Question rewrite mode: 'sequential' (retrieve once the standalone question is rewritten) or
+# 'speculative' (retrieve on the raw question while it is rewritten)
+QUESTION_REWRITE_MODE = os.getenv("QUESTION_REWRITE_MODE", "sequential")
+# Minimum cosine similarity between the raw and the standalone question for the speculative retrieval to be kept
+SPECULATIVE_MIN_SIMILARITY = float(os.getenv("SPECULATIVE_MIN_SIMILARITY", 0.95))
 
 def get_json_from_markdown(markdown_text):
     """
@@ -55,20 +75,47 @@ class AsyncModelCallbackHandler(AsyncCallbackHandler):
         raise error
 
 
+async def discard_task(task):
+    """
+    Cancel a task and wait for it to end. Its outcome is read, so that asyncio does not log the
+    exception of a task failing before the cancellation as never retrieved.
+
+    :param task: The asyncio task.
+    """
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+
 class LLM:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, memory: MemoryManager = None, version=None):
         """
         Initialize the LLM object with user configuration.
 
         :param config: Dictionary containing parameters for configuring ChatOpenAI.
+        :param memory: Memory manager shared between LLM instances, a new one is created if None.
+        :param version: Version of the LLM configuration, separating the cached answers of each configuration.
         """
         self.config = config
+        self.version = version
+        # Number of requests using the instance, its connections are closed once it is retired and unused
+        self.leases = 0
+        self.retired = False
+        self.lease_lock = Lock()
         # Create an instance of the model using the provided configuration.
         self.callback_manager = AsyncCallbackManager(
             handlers=[AsyncModelCallbackHandler()])
+        # Keep connections to the provider alive between requests.
+        self.http_async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+            )
+        )
         self.model = self.create_model()
         # Initialize a memory manager for this model.
-        self.memory = MemoryManager()
+        self.memory = memory if memory is not None else MemoryManager()
 
     def create_model(self):
         """
@@ -82,70 +129,294 @@ class LLM:
             # Set temperature (controls randomness in response).
             temperature=1,
             api_key=self.config.get("api_key", ''),
-            callbacks=self.callback_manager
+            callbacks=self.callback_manager,
+            http_async_client=self.http_async_client
         )
 
-    def get_memory(self, user_id, chat_id):
+    async def aclose(self):
+        """
+        Close the connections opened to the LLM provider.
+        """
+        await self.http_async_client.aclose()
+
+    def acquire(self):
+        """
+        Lease the instance for a request, it must be released with `release` once the request completes.
+
+        :return: The instance.
+        """
+        with self.lease_lock:
+            self.leases += 1
+        return self
+
+    def release(self):
+        """
+        Release a lease taken with `acquire`, closing the connections if the instance was retired and is now unused.
+        """
+        with self.lease_lock:
+            self.leases -= 1
+            close = self.retired and self.leases == 0
+        if close:
+            background_loop.submit(self.aclose())
+
+    def retire(self):
+        """
+        Mark the instance as replaced: its connections are closed as soon as the requests still using it complete.
+        """
+        with self.lease_lock:
+            self.retired = True
+            close = self.leases == 0
+        if close:
+            background_loop.submit(self.aclose())
+
+    def get_memory(self, user_id, chat_id, history=None):
         """
         Retrieve memory of the user from the memory manager.
 
         :param user_id: The ID of the user.
         :param chat_id: The ID of the chat session.
+        :param history: Last persisted messages of the chat, used to rebuild an empty memory.
         :return: User's memory for the given chat session.
         """
-        return self.memory.get_memory(user_id, chat_id)
+        return self.memory.get_memory(user_id, chat_id, history)
 
-    async def invoke_chain(self, payload: dict):
+    def load_memory(self, payload: dict):
         """
-        Invokes a chain of processes to handle a request, such as querying a language model.
+        Retrieve the memory of the chat targeted by a request.
 
         :param payload: Dictionary containing request data (user ID, chat ID, question, etc.).
-        :return: The result of invoking the chain.
+        :return: User's memory for the given chat session.
         """
-        # Get user memory based on user ID and chat ID from the payload.
         user_id = payload.get("user_id")
         chat_id = payload.get("chat_id")
-        user_mem = self.get_memory(user_id, chat_id)
+        user_mem = self.get_memory(user_id, chat_id, payload.get("history"))
         if user_mem is None:
             raise ValueError("User memory not found.")
+        return user_mem
+
+    def create_chain(self, user_mem):
+        """
+        Creates the chain of operations producing the raw text answer of the model.
 
-        # Define the context of the request by fetching chat history from user memory.
+        :param user_mem: Memory of the chat session.
+        :return: The runnable chain.
+        """
+        # Define the rewrite of the question into a standalone question, given the chat history.
         context = RunnablePassthrough.assign(
-            chat_history=RunnableLambda(
-                user_mem.load_memory_variables) | itemgetter("history")
+            chat_history=itemgetter("memory")
         ) | CONTEXT_PROMPT | self.model | StrOutputParser()
 
         # Define the entire chain of operations to process the request.
-        runnable = (
+        return (
             RunnablePassthrough.assign(
-                question=context,
                 memory=RunnableLambda(
                     user_mem.load_memory_variables) | itemgetter("history"),
                 industries=RunnableLambda(lambda x: x.get("industries"))
             )
-            | retrieve
-            | SYSTEM_PROMPT
-            | self.model
-            | StrOutputParser()
-            | get_json_from_markdown
+            | self.create_retrieval(context)
+            | RunnableBranch(
+                # Answer found in the answer cache, skip the generation
+                (lambda x: "cached_answer" in x, RunnableLambda(lambda x: json.dumps(x["cached_answer"], ensure_ascii=False))),
+                SYSTEM_PROMPT | self.model | StrOutputParser()
+            )
         )
 
-        try:
-            # Await the result of the chain invocation.
-            result = await runnable.ainvoke(payload)
-            # Update user memory with the new interaction.
-            user_mem.chat_memory.add_user_message(payload.get("question"))
-            user_mem.chat_memory.add_ai_message(str(result))
-            return result
-        except AuthenticationError as e:
+    def create_retrieval(self, context):
+        """
+        Creates the step rewriting the question into a standalone question and retrieving its context.
+
+        The first turn of a chat has no history to resolve the question against, so the rewrite is
+        skipped. With QUESTION_REWRITE_MODE 'speculative', the retrieval starts on the raw question
+        while the model rewrites it. The speculative context is kept when the standalone question is
+        the same or close enough (SPECULATIVE_MIN_SIMILARITY), otherwise the retrieval runs again on
+        the standalone question.
+        When the answer cache holds the answer of a similar standalone question, the retrieval is
+        skipped and the step returns the data with a 'cached_answer' key.
+
+        :param context: The chain rewriting the question.
+        :return: The runnable step.
+        """
+        def rewrite_and_retrieve(data):
+            question = context.invoke(data) if data["memory"] else data["question"]
+            cached = self.lookup_answer(data, question)
+            if cached is not None:
+                return cached
+            return retrieve({**data, "question": question})
+
+        async def arewrite_and_retrieve(data):
+            question = data["question"]
+            speculative = None
+            if data["memory"] and QUESTION_REWRITE_MODE == 'speculative':
+                # The speculative retrieval reports its own status, only used if its context is kept
+                status = self.retrieval_status()
+                speculative = asyncio.create_task(aretrieve({**data, "retrieval_status": status}))
+            try:
+                if data["memory"]:
+                    question = await context.ainvoke(data)
+
+                # The embedding and the ingest generation check of the cache lookup may block
+                cached = await offload(self.lookup_answer, data, question)
+                if cached is not None:
+                    return cached
+
+                if speculative is not None:
+                    if (normalize_text(question) == normalize_text(data["question"])
+                            or await aquestion_similarity(data["question"], question) >= SPECULATIVE_MIN_SIMILARITY):
+                        result = await speculative
+                        if status["degraded"] and "retrieval_status" in data:
+                            data["retrieval_status"]["degraded"] = True
+                        return {**result, "question": question, "retrieval_status": data.get("retrieval_status")}
+            finally:
+                # The speculative retrieval is not used: rewrite error, cached answer or different question
+                if speculative is not None and not speculative.done():
+                    await discard_task(speculative)
+            return await aretrieve({**data, "question": question})
+
+        return RunnableLambda(rewrite_and_retrieve, afunc=arewrite_and_retrieve)
+
+    @staticmethod
+    def retrieval_status():
+        """
+        Creates the status filled by the retrieval step of the chain.
+
+        :return: Dictionary with the keys:
+            - 'degraded': set to True by `retrieve` when the context comes from a fallback because Weaviate or MongoDB failed.
+            - 'cached': set to True when the answer comes from the answer cache.
+            - 'question_vector': embedding of the standalone question, set by `lookup_answer`.
+        """
+        return {'degraded': False, 'cached': False, 'question_vector': None}
+
+    def lookup_answer(self, data: dict, question: str):
+        """
+        Look up the answer cache for the standalone question of a request.
+
+        :param data: The data of the retrieval step.
+        :param question: The standalone question.
+        :return: The data with the question and the 'cached_answer' key on a hit, None on a miss.
+        """
+        if answer_cache.max_size <= 0:
+            return None
+        vector = embeddings.embed_query(question)
+        status = data.get("retrieval_status")
+        if status is not None:
+            status["question_vector"] = vector
+        answer = answer_cache.get(vector, data.get("industries"), self.version)
+        if answer is None:
+            return None
+        if status is not None:
+            status["cached"] = True
+        return {**data, "question": question, "cached_answer": answer}
+
+    def cache_answer(self, payload: dict, status: dict, result):
+        """
+        Add the answer of a request to the answer cache, unless it is not a valid answer, comes
+        from the cache or was built from a degraded context.
+
+        :param payload: Dictionary containing request data.
+        :param status: The retrieval status of the request.
+        :param result: The parsed answer of the model.
+        """
+        if status['cached'] or status['degraded'] or status['question_vector'] is None:
+            return
+        if not isinstance(result, dict) or 'answer' not in result or 'references' not in result:
+            return
+        answer_cache.put(
+            status['question_vector'], payload.get("industries"), self.version,
+            {'answer': result['answer'], 'references': result['references']}
+        )
+
+    def save_interaction(self, payload: dict, result):
+        """
+        Update user memory with a new interaction.
+        Only the answer text is kept, like in the chat history saved by the chat routes, which
+        replaces the memory window when the request carries it.
+
+        :param payload: Dictionary containing request data.
+        :param result: The answer of the model.
+        """
+        answer = result['answer'] if isinstance(result, dict) and 'answer' in result else result
+        self.memory.add_interaction(payload.get("user_id"), payload.get("chat_id"), payload.get("question"), str(answer))
+
+    @staticmethod
+    def invocation_error(e: Exception):
+        """
+        Translates the errors of the LLM provider into LLMInvocationError.
+
+        :param e: The exception raised while invoking the chain.
+        :return: The matching LLMInvocationError, None if the error is not a provider error.
+        """
+        if isinstance(e, LLMInvocationError):
+            return e
+        if isinstance(e, AuthenticationError):
             logging.error(f'Authentication error: {e}')
-            raise LLMInvocationError(401, "Authentication failed. Please verify your API key or credentials.", e)
-        except APIConnectionError as e:
+            return LLMInvocationError(401, "Authentication failed. Please verify your API key or credentials.", e)
+        if isinstance(e, APIConnectionError):
             logging.error(f'Connection error: {e}')
-            raise LLMInvocationError(404, "Connection to the requested URI failed. Please verify the URI provided.", e)
-        except NotFoundError as e:
+            return LLMInvocationError(404, "Connection to the requested URI failed. Please verify the URI provided.", e)
+        if isinstance(e, NotFoundError):
             logging.error(f'Model not found error: {e}')
-            raise LLMInvocationError(400, "The model you try to request does not exist. Please provide a valid model name.", e)
+            return LLMInvocationError(400, "The model you try to request does not exist. Please provide a valid model name.", e)
+        return None
+
+    async def invoke_chain(self, payload: dict):
+        """
+        Invokes a chain of processes to handle a request, such as querying a language model.
+
+        :param payload: Dictionary containing request data (user ID, chat ID, question, etc.).
+        :return: The result of invoking the chain.
+        """
+        user_mem = self.load_memory(payload)
+        runnable = self.create_chain(user_mem) | get_json_from_markdown
+        status = self.retrieval_status()
+
+        try:
+            # Await the result of the chain invocation.
+            result = await runnable.ainvoke({**payload, 'retrieval_status': status})
+            self.save_interaction(payload, result)
+            self.cache_answer(payload, status, result)
+            if isinstance(result, dict):
+                result['degraded'] = status['degraded']
+            return result
         except Exception as e:
+            error = self.invocation_error(e)
+            if error is not None:
+                raise error
             logging.error(f'Exception in invoke chain : {e} - exception is of type {type(e)}')
             return e
+
+    async def astream_chain(self, payload: dict):
+        """
+        Invokes the chain like `invoke_chain`, streaming the answer while the model generates it.
+
+        Yields dictionaries with a 'type' key:
+            - 'token': 'text' holds the next part of the answer, as soon as the model emits it.
+            - 'result': 'result' holds the full parsed answer (with references), yielded last.
+
+        :param payload: Dictionary containing request data (user ID, chat ID, question, etc.).
+        :raises LLMInvocationError: If the invocation failed.
+        """
+        user_mem = self.load_memory(payload)
+        parser = AnswerStreamParser()
+        chunks = []
+        status = self.retrieval_status()
+
+        try:
+            async for chunk in self.create_chain(user_mem).astream({**payload, 'retrieval_status': status}):
+                chunks.append(chunk)
+                text = parser.feed(chunk)
+                if text:
+                    yield {'type': 'token', 'text': text}
+        except Exception as e:
+            error = self.invocation_error(e)
+            if error is not None:
+                raise error
+            logging.error(f'Exception in stream chain : {e} - exception is of type {type(e)}')
+            raise LLMInvocationError(500, str(e), e)
+
+        # The references are only known once the whole JSON has been generated.
+        result = get_json_from_markdown(''.join(chunks))
+        self.save_interaction(payload, result)
+        self.cache_answer(payload, status, result)
+        if isinstance(result, dict):
+            result['degraded'] = status['degraded']
+        yield {'type': 'result', 'result': result}
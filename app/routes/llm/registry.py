@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+from threading import Lock
+from flask import current_app
+
+from ..llm_config.models import LLMConfig, on_llm_config_change
+from .model import LLM
+from .utils.memory import MEMORY_BACKEND, MemoryManager
+
+# Number of seconds between two checks of the selected configuration in the database,
+# so that changes made by another worker process are eventually picked up.
+LLM_REGISTRY_REVALIDATE_INTERVAL = float(os.getenv("LLM_REGISTRY_REVALIDATE_INTERVAL", 30))
+
+
+class LLMRegistry:
+    """
+    Process-wide registry keeping one LLM instance for the selected configuration.
+
+    The instance (and therefore its ChatOpenAI client and keep-alive connections to the
+    provider) is reused until the selected configuration changes. Changes made in this
+    process invalidate the registry immediately through the LLMConfig change hooks,
+    changes made by other workers are detected by comparing the configuration version
+    every `revalidate_interval` seconds.
+    Callers lease the instance through `get` and release it once their request completes,
+    a replaced instance only closes its connections when its last request is done.
+    The conversation memory is shared by the successive LLM instances.
+    """
+
+    def __init__(self, revalidate_interval=LLM_REGISTRY_REVALIDATE_INTERVAL):
+        self.revalidate_interval = revalidate_interval
+        self.instance = None
+        self.version = None
+        self.checked_at = 0
+        self.memory = None
+        self.lock = Lock()
+
+    def invalidate(self):
+        """
+        Drop the cached LLM instance if the selected configuration or its version changed, the next
+        call to `get` rebuilds it. Must be called within an application context.
+        """
+        try:
+            version = LLMConfig.get_selected_version()
+        except Exception as e:
+            logging.error(f'Failed to read the selected LLM configuration: {e}')
+            version = None
+        with self.lock:
+            if version is None or version != self.version:
+                self.replace(None, None)
+
+    def replace(self, instance, version):
+        """
+        Replace the cached LLM instance, retiring the previous one: its connections are closed
+        once the requests still using it complete. Must be called with the lock held.
+        """
+        previous = self.instance
+        self.instance = instance
+        self.version = version
+        self.checked_at = time.monotonic()
+        if previous is not None and previous is not instance:
+            previous.retire()
+
+    @staticmethod
+    def create_memory():
+        """
+        Create the conversation memory manager, persisted in the session Redis when MEMORY_BACKEND is 'redis'.
+        Must be called within an application context.
+        """
+        redis_client = None
+        if MEMORY_BACKEND == 'redis':
+            redis_client = current_app.config.get('SESSION_REDIS')
+        return MemoryManager(redis_client=redis_client)
+
+    def get(self) -> LLM:
+        """
+        Lease the LLM instance of the selected configuration. Must be called within an application context.
+        The caller must call `release` on the instance once its request completes.
+
+        :return: The shared LLM instance.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.instance is not None and now - self.checked_at < self.revalidate_interval:
+                return self.instance.acquire()
+
+            if self.memory is None:
+                self.memory = self.create_memory()
+
+            version = LLMConfig.get_selected_version()
+            if self.instance is None or version != self.version:
+                logging.info(f'Loading LLM configuration {version}')
+                self.replace(LLM(LLMConfig.get_selected_llm(), self.memory, version), version)
+            self.checked_at = now
+            return self.instance.acquire()
+
+
+# Shared LLM registry for the whole process
+llm_registry = LLMRegistry()
+on_llm_config_change(llm_registry.invalidate)
@@ -3,9 +3,13 @@ from flask import request, redirect
 
 from .utils.llm_exception_handler import LLMInvocationError
 
-from ..llm_config.models import LLMConfig
 from . import llm
-from .model import LLM
+from . import service
+from .utils.answer_cache import answer_cache
+from .utils.context_builder import context_builder
+from .utils.document_cache import document_cache
+from .utils.score_cache import rerank_score_cache
+from .utils.retriever import embeddings, mongo_breaker, retriever_pool, vector_store_breaker
 
 # Define the route for the root endpoint to redirect to the documentation page.
 @llm.route("/")
@@ -26,11 +30,8 @@ async def invoke_chain():
         payload = request.json
         logging.info(f'Payload: {payload}')
         
-        llm_config = LLMConfig.get_selected_llm()        
-        
-        llm_instance = LLM(llm_config)
-        
-        response = await llm_instance.invoke_chain(payload)
+        # Thin HTTP adapter over the in-process LLM service.
+        response = await service.ainvoke(payload)
         
         return response, 200
     
@@ -43,4 +44,25 @@ async def invoke_chain():
     except Exception as e:
         return {"error": 500, "message": str(e)}, 500
 
-
+# Define the route for the '/stats' endpoint exposing the retrieval caches statistics.
+@llm.route("/stats", methods=["GET"])
+def cache_stats():
+    """
+    Endpoint returning the hit/miss statistics of the caches and the state of the circuit breakers,
+    the reranking throughput and the context sizes of this worker.
+    """
+    return {
+        "error": 0,
+        "message": "Cache statistics retrieved",
+        "data": {
+            "answers": answer_cache.stats(),
+            "query_embeddings": embeddings.stats(),
+            "documents": document_cache.stats(),
+            "rerank_scores": rerank_score_cache.stats(),
+            "reranker": retriever_pool.reranker_stats(),
+            "context": context_builder.stats(),
+            "circuit_breakers": {
+                breaker.name: breaker.stats() for breaker in (vector_store_breaker, mongo_breaker)
+            }
+        }
+    }, 200
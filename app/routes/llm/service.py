@@ -0,0 +1,113 @@
+import queue
+
+from .registry import llm_registry
+from .utils.event_loop import background_loop
+from .utils.llm_exception_handler import LLMInvocationError
+
+# In-process interface to the LLM chain, used by the chat blueprint and by the
+# /llm/invoke route. Every function must be called within an application context.
+
+
+def build_payload(user_id, chat_id, question, history, industries):
+    """
+    Build the payload expected by LLM.invoke_chain.
+
+    :param user_id: The ID of the user asking the question.
+    :param chat_id: The ID of the chat.
+    :param question: The question asked by the user.
+    :param history: List of previous messages of the chat.
+    :param industries: List of industries the user is allowed to query, or 'all'.
+    :return: The payload dictionary.
+    """
+    return {
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'history': history,
+        'question': question,
+        'industries': industries
+    }
+
+
+def check_result(result):
+    """
+    Turn the errors returned (rather than raised) by LLM.invoke_chain into exceptions.
+
+    :param result: The value returned by invoke_chain.
+    :return: The result when it is not an error.
+    """
+    if isinstance(result, Exception):
+        raise LLMInvocationError(500, str(result), result)
+    return result
+
+
+def invoke(payload, timeout=None):
+    """
+    Invoke the chain of the selected LLM and block until the answer is ready.
+
+    :param payload: Dictionary containing request data (see build_payload).
+    :param timeout: Maximum number of seconds to wait, None to wait forever.
+    :return: The parsed answer of the model.
+    :raises LLMInvocationError: If the invocation failed.
+    """
+    llm_instance = llm_registry.get()
+    try:
+        return check_result(background_loop.run(llm_instance.invoke_chain(payload), timeout))
+    finally:
+        llm_instance.release()
+
+
+async def ainvoke(payload):
+    """
+    Invoke the chain of the selected LLM from an async view.
+
+    :param payload: Dictionary containing request data (see build_payload).
+    :return: The parsed answer of the model.
+    :raises LLMInvocationError: If the invocation failed.
+    """
+    llm_instance = llm_registry.get()
+    try:
+        return check_result(await background_loop.wrap(llm_instance.invoke_chain(payload)))
+    finally:
+        llm_instance.release()
+
+
+def stream(payload):
+    """
+    Invoke the chain of the selected LLM, streaming the answer while it is generated.
+
+    The chain runs on the background loop and its events are handed over to the
+    calling thread through a queue, so this can be consumed by a sync Flask response.
+
+    :param payload: Dictionary containing request data (see build_payload).
+    :return: A generator of the events yielded by LLM.astream_chain.
+    :raises LLMInvocationError: If the invocation failed.
+    """
+    events = queue.Queue()
+
+    async def produce(llm_instance):
+        try:
+            async for event in llm_instance.astream_chain(payload):
+                events.put(event)
+        except Exception as e:
+            events.put({'type': 'error', 'error': e})
+        finally:
+            events.put(None)
+
+    def consume():
+        # Lease the instance only once the response is consumed, so that it is always released
+        llm_instance = llm_registry.get()
+        future = background_loop.submit(produce(llm_instance))
+        try:
+            while (event := events.get()) is not None:
+                if event['type'] == 'error':
+                    error = event['error']
+                    if isinstance(error, LLMInvocationError):
+                        raise error
+                    raise LLMInvocationError(500, str(error), error)
+                yield event
+        finally:
+            # Stop generating if the consumer went away (e.g. client disconnected).
+            future.cancel()
+            llm_instance.release()
+
+    return consume()
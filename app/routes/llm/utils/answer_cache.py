@@ -0,0 +1,132 @@
+import os
+import time
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+import numpy as np
+
+from ...mongo import ingest_generation
+
+# Maximum number of answers kept in memory, 0 (the default) disables the cache
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 0))
+# Number of seconds an answer is served from the cache
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+# Minimum cosine similarity between the standalone questions for a cached answer to be served
+ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv("ANSWER_CACHE_MIN_SIMILARITY", 0.97))
+
+
+class AnswerCache:
+    """
+    Semantic LRU cache of the answers of the model.
+
+    Answers are partitioned by industry filter and LLM configuration version, so that a user
+    never gets an answer built from incidents or by a model they did not select. Within a
+    partition, a question is served the answer of the most similar cached standalone question
+    when their cosine similarity reaches `min_similarity`. Entries expire after `ttl` seconds
+    and the cache is cleared when the ingest generation written by create_dbs.py changes.
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, min_similarity=ANSWER_CACHE_MIN_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        # Entries (partition, normalized vector, answer, expiry) by insertion id, least recently used first
+        self.entries = OrderedDict()
+        self.ids = count()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def partition(industries, version):
+        """
+        Build the partition key of an industry filter and an LLM configuration version.
+
+        :param industries: List of industries, or 'all'.
+        :param version: Version of the LLM configuration.
+        :return: A hashable key.
+        """
+        return ('all' if industries == 'all' else frozenset(industries), version)
+
+    def check_generation(self, generation):
+        """
+        Clear the cache if the corpus was re-ingested. Must be called with the lock held.
+
+        :param generation: The current ingest generation.
+        """
+        if generation != self.generation:
+            self.entries.clear()
+            self.generation = generation
+
+    def get(self, vector, industries, version):
+        """
+        Get the cached answer of the most similar question.
+
+        :param vector: Embedding of the standalone question.
+        :param industries: List of industries, or 'all'.
+        :param version: Version of the LLM configuration.
+        :return: The cached answer, None on a miss.
+        """
+        if self.max_size <= 0:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        partition = self.partition(industries, version)
+        generation = ingest_generation.get()
+        now = time.monotonic()
+        with self.lock:
+            self.check_generation(generation)
+            best, best_similarity = None, self.min_similarity
+            for id, (entry_partition, entry_vector, _, expiry) in list(self.entries.items()):
+                if expiry <= now:
+                    del self.entries[id]
+                    continue
+                if entry_partition != partition:
+                    continue
+                similarity = float(entry_vector @ vector)
+                if similarity >= best_similarity:
+                    best, best_similarity = id, similarity
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            self.hits += 1
+            return self.entries[best][2]
+
+    def put(self, vector, industries, version, answer):
+        """
+        Add the answer of a question to the cache.
+
+        :param vector: Embedding of the standalone question.
+        :param industries: List of industries, or 'all'.
+        :param version: Version of the LLM configuration.
+        :param answer: The answer, a dictionary with 'answer' and 'references'.
+        """
+        if self.max_size <= 0:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self.lock:
+            self.entries[next(self.ids)] = (self.partition(industries, version), vector, answer, time.monotonic() + self.ttl)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        :return: Dictionary of hit/miss counters and cache size.
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+# Shared answer cache for the whole process
+answer_cache = AnswerCache()
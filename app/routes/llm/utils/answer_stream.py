@@ -0,0 +1,95 @@
+import json
+
+
+class AnswerStreamParser:
+    """
+    Incrementally extracts the value of the "answer" property from the JSON text
+    streamed by the model, so that the answer can be forwarded to the client while
+    the rest of the JSON (the references) is still being generated.
+
+    Usage:
+        parser = AnswerStreamParser()
+        for chunk in chunks:
+            text = parser.feed(chunk)  # newly decoded part of the answer, may be empty
+    """
+    KEY = '"answer"'
+
+    # Parser states
+    STATE_KEY = 0    # Looking for the "answer" key
+    STATE_OPEN = 1   # Looking for the opening quote of the value
+    STATE_VALUE = 2  # Inside the value string
+    STATE_DONE = 3   # Closing quote found, nothing more to extract
+
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.state = AnswerStreamParser.STATE_KEY
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of model output to the parser.
+
+        :param chunk: Text emitted by the model.
+        :return: The part of the answer decoded thanks to this chunk.
+        """
+        self.buffer += chunk
+        output = []
+
+        if self.state == AnswerStreamParser.STATE_KEY:
+            index = self.buffer.find(self.KEY, self.position)
+            if index == -1:
+                # Keep the end of the buffer in case the key is split between two chunks.
+                self.position = max(self.position, len(self.buffer) - len(self.KEY) + 1)
+                return ''
+            self.position = index + len(self.KEY)
+            self.state = AnswerStreamParser.STATE_OPEN
+
+        if self.state == AnswerStreamParser.STATE_OPEN:
+            while self.position < len(self.buffer):
+                char = self.buffer[self.position]
+                self.position += 1
+                if char == '"':
+                    self.state = AnswerStreamParser.STATE_VALUE
+                    break
+                if not char.isspace() and char != ':':
+                    # Not the property we are looking for, search the next occurrence.
+                    self.state = AnswerStreamParser.STATE_KEY
+                    return self.feed('')
+
+        while self.state == AnswerStreamParser.STATE_VALUE and self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if char == '"':
+                self.position += 1
+                self.state = AnswerStreamParser.STATE_DONE
+            elif char == '\\':
+                length = self.escape_length()
+                if length is None:
+                    # Escape sequence not complete yet, wait for the next chunk.
+                    break
+                output.append(json.loads('"' + self.buffer[self.position:self.position + length] + '"'))
+                self.position += length
+            else:
+                output.append(char)
+                self.position += 1
+
+        return ''.join(output)
+
+    def escape_length(self):
+        """
+        Length of the escape sequence starting at the current position.
+
+        :return: The number of characters of the sequence, None if it is not fully received.
+        """
+        available = len(self.buffer) - self.position
+        if available < 2:
+            return None
+        if self.buffer[self.position + 1] != 'u':
+            return 2
+        if available < 6:
+            return None
+        # A high surrogate must be decoded together with the following low surrogate.
+        if 0xD800 <= int(self.buffer[self.position + 2:self.position + 6], 16) <= 0xDBFF:
+            if available < 12:
+                return None
+            return 12
+        return 6
@@ -0,0 +1,208 @@
+import asyncio
+import math
+import re
+from collections import Counter, defaultdict
+from typing import List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .event_loop import offload
+
+# Fields of the incident documents indexed for lexical search
+BM25_FIELDS = ["accident_title", "accident_description", "causes_of_accident", "lesson_learned"]
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constant of the reciprocal rank fusion, dampening the weight of the first ranks
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in into is it its
+may of on or should so than that the their them then there these they this to was were what when where
+which while who why will with would
+""".split())
+
+
+def tokenize(text):
+    """
+    Split a text into lower-cased terms, without stop words.
+
+    :param text: The text, may be None.
+    :return: List of terms.
+    """
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index of the incidents, complementing the dense retrieval on
+    exact terms (substance names, acronyms, processes) that embeddings tend to blur.
+
+    The BM25 weight of each (term, document) posting is computed once at build time, a
+    query only sums the weights of the postings of its terms.
+    """
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        """
+        :param documents: Incident documents (dictionaries with the fields of the MongoDB collection).
+        :param k1: Term frequency saturation.
+        :param b: Document length normalization.
+        """
+        self.documents = [
+            {
+                "incident_id": document["accident_id"],
+                "industry": document.get("industry_type"),
+                "event": document.get("event_type"),
+                "source": document.get("url"),
+                "text": (document.get("accident_title") or "") + "\n" + (document.get("accident_description") or "")
+            }
+            for document in documents
+        ]
+        self.industries = np.array([document["industry"] for document in self.documents], dtype=object)
+
+        term_frequencies = [
+            Counter(token for field in BM25_FIELDS for token in tokenize(document.get(field)))
+            for document in documents
+        ]
+        lengths = np.array([sum(frequencies.values()) for frequencies in term_frequencies], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+
+        postings = defaultdict(lambda: ([], []))
+        for row, frequencies in enumerate(term_frequencies):
+            for term, frequency in frequencies.items():
+                rows, tfs = postings[term]
+                rows.append(row)
+                tfs.append(frequency)
+
+        # Postings of each term: (rows, BM25 weights)
+        self.postings = {}
+        n_documents = len(self.documents)
+        for term, (rows, tfs) in postings.items():
+            rows = np.array(rows, dtype=np.int64)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (n_documents - len(rows) + 0.5) / (len(rows) + 0.5))
+            norms = k1 * (1 - b + b * lengths[rows] / average_length)
+            self.postings[term] = (rows, (idf * tfs * (k1 + 1) / (tfs + norms)).astype(np.float32))
+
+    @classmethod
+    def from_collection(cls, collection):
+        """
+        Build the index from the incident collection.
+
+        :param collection: The MongoDB incident collection.
+        :return: The BM25Index.
+        """
+        projection = {field: 1 for field in BM25_FIELDS + ["accident_id", "industry_type", "event_type", "url"]}
+        projection["_id"] = 0
+        return cls(list(collection.find({}, projection)))
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query, k, industries=None):
+        """
+        Find the documents with the highest BM25 score for a query.
+
+        :param query: The query text.
+        :param k: Number of documents to return.
+        :param industries: List of industries to keep, None or 'all' to keep every industry.
+        :return: List of (row, score) pairs, best first, only documents sharing a term with the query.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                rows, weights = self.postings[term]
+                scores[rows] += weights
+        if industries is not None and industries != 'all':
+            scores[~np.isin(self.industries, list(industries))] = 0
+        rows = np.flatnonzero(scores > 0)
+        if len(rows) > k:
+            rows = rows[np.argpartition(scores[rows], -k)[-k:]]
+        rows = rows[np.argsort(scores[rows])[::-1]]
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def to_document(self, row):
+        """
+        Build the LangChain document of a row, with the same content and metadata as the vector store documents.
+        """
+        document = self.documents[row]
+        return Document(
+            page_content=document["text"],
+            metadata={
+                "incident_id": document["incident_id"],
+                "industry": document["industry"],
+                "event": document["event"],
+                "source": document["source"]
+            }
+        )
+
+
+class BM25Retriever(BaseRetriever):
+    """Retriever searching a BM25Index."""
+
+    index: BM25Index
+    """Index to search."""
+    industries: Optional[List[str]] = None
+    """Industries to keep, None to keep every industry."""
+    k: int = 10
+    """Number of documents to return."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [self.index.to_document(row) for row, _ in self.index.search(query, self.k, self.industries)]
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return await offload(self._get_relevant_documents, query)
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """
+    Fuse rankings of documents by reciprocal rank fusion: each document scores the sum of
+    1 / (rrf_k + rank) over the rankings it appears in.
+
+    :param rankings: Lists of documents, best first, identified by their 'incident_id' metadata.
+    :param k: Number of documents to return.
+    :param rrf_k: Fusion constant.
+    :return: The k documents with the highest fused score, best first.
+    """
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            key = document.metadata["incident_id"]
+            scores[key] += 1 / (rrf_k + rank + 1)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing the results of several first-stage retrievers by reciprocal rank fusion."""
+
+    retrievers: List[BaseRetriever]
+    """Retrievers to fuse, e.g. a dense and a BM25 retriever."""
+    k: int = 8
+    """Number of fused documents to return."""
+    rrf_k: int = RRF_K
+    """Reciprocal rank fusion constant."""
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        rankings = [
+            retriever.invoke(query, config={"callbacks": run_manager.get_child() if run_manager else None})
+            for retriever in self.retrievers
+        ]
+        return reciprocal_rank_fusion(rankings, self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        # The first-stage retrievers run concurrently
+        rankings = await asyncio.gather(*(
+            retriever.ainvoke(query, config={"callbacks": run_manager.get_child() if run_manager else None})
+            for retriever in self.retrievers
+        ))
+        return reciprocal_rank_fusion(rankings, self.k, self.rrf_k)
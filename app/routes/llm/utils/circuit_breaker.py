@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import Lock
+
+# Number of consecutive failures after which a circuit opens
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+# Number of seconds an open circuit rejects calls before letting a trial call through
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+# Number of threads running the calls guarded by a timeout
+DEPENDENCY_WORKERS = int(os.getenv("DEPENDENCY_WORKERS", 32))
+
+# Threads running the guarded calls, so that the caller can stop waiting after the timeout
+executor = ThreadPoolExecutor(max_workers=DEPENDENCY_WORKERS, thread_name_prefix="dependency")
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit of the dependency is open."""
+
+    def __init__(self, name):
+        super().__init__(f"Circuit of {name} is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker guarding the calls to an external dependency (Weaviate, MongoDB).
+
+    Each call is bounded by `timeout` seconds. After `failure_threshold` consecutive
+    failures or timeouts the circuit opens and calls are rejected right away, instead of
+    spending the latency budget of every request on a dependency known to be down. Once
+    `reset_timeout` seconds have passed, a single trial call is let through (half-open):
+    its success closes the circuit, its failure opens it again. A trial call interrupted
+    without an outcome (cancelled task, KeyboardInterrupt) reopens the circuit without
+    counting a failure, so that the next call is let through as a new trial.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, timeout, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.calls = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.lock = Lock()
+
+    def allow(self):
+        """
+        Check whether a call may go through, moving an open circuit to half-open once the reset timeout has passed.
+
+        :return: True if the call may be made.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let a single trial call through
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self, timeout=False):
+        with self.lock:
+            self.failures += 1
+            if timeout:
+                self.timeouts += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_interrupted(self, trial):
+        """
+        Give the trial back when a half-open call is interrupted before it completes, the
+        circuit is open again and its reset timeout already elapsed.
+
+        :param trial: Whether the interrupted call was the trial call.
+        """
+        with self.lock:
+            if trial and self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call a function through the breaker.
+
+        :param func: The function calling the dependency.
+        :return: The result of the function.
+        :raises CircuitOpenError: If the circuit is open.
+        :raises TimeoutError: If the call did not complete within the timeout.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        with self.lock:
+            self.calls += 1
+            trial = self.state == self.HALF_OPEN
+        future = executor.submit(func, *args, **kwargs)
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The call keeps running in its thread until the client timeout, but nobody waits for it
+            future.cancel()
+            self.record_failure(timeout=True)
+            raise TimeoutError(f"Call to {self.name} timed out after {self.timeout}s")
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            future.cancel()
+            self.record_interrupted(trial)
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """
+        Await a coroutine function through the breaker, on the running event loop.
+
+        :param func: The coroutine function calling the dependency.
+        :return: The result of the coroutine.
+        :raises CircuitOpenError: If the circuit is open.
+        :raises TimeoutError: If the call did not complete within the timeout.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        with self.lock:
+            self.calls += 1
+            trial = self.state == self.HALF_OPEN
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), self.timeout)
+        except asyncio.TimeoutError:
+            self.record_failure(timeout=True)
+            raise TimeoutError(f"Call to {self.name} timed out after {self.timeout}s")
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # asyncio.CancelledError, the caller gave up on the call
+            self.record_interrupted(trial)
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        """
+        Get the breaker statistics.
+
+        :return: Dictionary of the state and counters of the breaker.
+        """
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected
+        }
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import re
+from threading import Lock
+
+from .bm25 import TOKEN_PATTERN, tokenize
+
+# Maximum number of tokens of the context given to the model, 0 to pass the whole documents
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+# tiktoken encoding used to count the tokens, the characters / 4 estimate is used when tiktoken is not installed
+CONTEXT_TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base")
+
+# Short fields of the incidents, always kept: the model needs them to write the references
+CONTEXT_KEPT_FIELDS = ["accident_id", "event_type", "industry_type", "accident_title", "start_date", "finish_date", "url"]
+# Long text fields of the incidents, reduced to their most relevant sentences, with their default weight
+CONTEXT_TEXT_FIELDS = {
+    "accident_description": 1.0,
+    "causes_of_accident": 0.8,
+    "lesson_learned": 0.8,
+    "consequences": 0.6,
+    "emergency_response": 0.6
+}
+# Words of the question asking for a text field in particular, whose weight is then raised to QUERY_FIELD_WEIGHT
+QUERY_FIELD_WORDS = {
+    "causes_of_accident": {"cause", "caused", "causes", "why", "reason", "reasons", "root", "factor", "factors"},
+    "consequences": {
+        "consequence", "consequences", "impact", "impacts", "injury", "injuries", "injured", "damage", "damages",
+        "fatality", "fatalities", "killed", "death", "deaths", "casualties", "effect", "effects"
+    },
+    "emergency_response": {
+        "response", "respond", "responded", "emergency", "evacuation", "evacuated", "firefighters", "rescue",
+        "handled", "managed", "actions"
+    },
+    "lesson_learned": {
+        "lesson", "lessons", "learned", "learnt", "prevent", "prevention", "recommendation", "recommendations",
+        "avoid", "measures", "improve", "improvements"
+    }
+}
+QUERY_FIELD_WEIGHT = 2.0
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?;])\s+")
+
+# tiktoken encoding, loaded on first use (False once it failed to load)
+encoding = None
+encoding_lock = Lock()
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a text with tiktoken, or estimate them as one token every four characters.
+    The model tokenizer is not known here, so the count is an approximation either way.
+
+    :param text: The text.
+    :return: Number of tokens.
+    """
+    global encoding
+    with encoding_lock:
+        if encoding is None:
+            try:
+                import tiktoken
+                encoding = tiktoken.get_encoding(CONTEXT_TOKEN_ENCODING)
+            except Exception as e:
+                logging.info(f'tiktoken unavailable, estimating the context tokens from its length: {e}')
+                encoding = False
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def split_sentences(text):
+    """
+    Split a text into sentences.
+
+    :param text: The text, may be None.
+    :return: List of non-empty sentences.
+    """
+    if not text or not isinstance(text, str):
+        return []
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+def field_weights(question):
+    """
+    Weight the text fields for a question, raising the fields it asks for (causes, lessons...).
+
+    :param question: The standalone question.
+    :return: Dictionary of weights by text field.
+    """
+    words = set(TOKEN_PATTERN.findall(question.lower()))
+    return {
+        field: QUERY_FIELD_WEIGHT if words & QUERY_FIELD_WORDS.get(field, set()) else weight
+        for field, weight in CONTEXT_TEXT_FIELDS.items()
+    }
+
+
+class PreparedDocument:
+    """
+    Incident parsed once for the context builder: its serialized form, the entry of its short
+    fields and the sentences of its text fields, with their token counts. Prepared documents
+    are cached by the document cache, so a request only scores their sentences.
+    """
+
+    __slots__ = ("serialized", "tokens", "entry", "entry_tokens", "sentences")
+
+    def __init__(self, serialized):
+        """
+        :param serialized: The JSON serialized incident.
+        """
+        document = json.loads(serialized)
+        self.serialized = serialized
+        self.tokens = count_tokens(serialized)
+        self.entry = {field: document[field] for field in CONTEXT_KEPT_FIELDS if document.get(field) is not None}
+        self.entry_tokens = count_tokens(json.dumps(self.entry, ensure_ascii=False))
+        # Sentences of the text fields: (field, sentence index, sentence, terms key, terms, tokens)
+        self.sentences = []
+        for field in CONTEXT_TEXT_FIELDS:
+            for index, sentence in enumerate(split_sentences(document.get(field))):
+                key = " ".join(tokenize(sentence))
+                if not key:
+                    continue
+                # Field name, quotes and separator
+                tokens = count_tokens(sentence) + (1 if index else count_tokens(field) + 4)
+                self.sentences.append((field, index, sentence, key, frozenset(key.split()), tokens))
+
+
+class ContextBuilder:
+    """
+    Builder of the context of the system prompt under a token budget.
+
+    Each incident keeps its short fields. Its long text fields are reduced to the sentences that
+    fit the budget, picked by relevance to the question: shared terms, weight of the field for
+    the question, position of the sentence in its field and rank of the incident given by the
+    reranker. The first sentence of the description is favoured, as it usually summarizes the accident. Sentences repeated across
+    incidents are only kept once, and the kept sentences stay in their original order.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self.contexts = 0
+        self.source_tokens = 0
+        self.context_tokens = 0
+        self.truncated = 0
+        self.lock = Lock()
+
+    def build(self, question, documents):
+        """
+        Build the context of a question.
+
+        :param question: The standalone question.
+        :param documents: List of the PreparedDocument of the incidents, best first.
+        :return: The context text.
+        """
+        if self.budget <= 0 or not documents:
+            return "\n\n".join(document.serialized for document in documents)
+
+        entries = [dict(document.entry) for document in documents]
+        used = sum(document.entry_tokens for document in documents)
+
+        # Candidate sentences: (score, document rank, field, sentence index, sentence, tokens)
+        terms = set(tokenize(question))
+        weights = field_weights(question)
+        seen = set()
+        candidates = []
+        for rank, document in enumerate(documents):
+            for field, index, sentence, key, sentence_terms, tokens in document.sentences:
+                if key in seen:
+                    continue
+                seen.add(key)
+                relevance = 1 + len(terms & sentence_terms)
+                if field == "accident_description" and index == 0:
+                    relevance += 1
+                # Later sentences of a field and lower ranked incidents are less likely to matter
+                score = weights[field] * relevance / (1 + rank) / (1 + index) ** 0.5
+                candidates.append((score, rank, field, index, sentence, tokens))
+
+        # Keep the best sentences fitting the budget
+        kept = []
+        for candidate in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+            if used + candidate[5] <= self.budget:
+                kept.append(candidate)
+                used += candidate[5]
+        fields = list(CONTEXT_TEXT_FIELDS)
+        for _, rank, field, index, sentence, _ in sorted(kept, key=lambda candidate: (candidate[1], fields.index(candidate[2]), candidate[3])):
+            entries[rank][field] = entries[rank][field] + " " + sentence if field in entries[rank] else sentence
+
+        context = "\n\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries)
+        # Token counts of the documents and sentences computed once per document, not per request
+        with self.lock:
+            self.contexts += 1
+            self.source_tokens += sum(document.tokens for document in documents)
+            self.context_tokens += used
+            self.truncated += len(kept) < len(candidates)
+        return context
+
+    def stats(self):
+        """
+        Get the context statistics.
+
+        :return: Dictionary of the budget and the average token counts before and after the reduction.
+        """
+        with self.lock:
+            return {
+                'budget': self.budget,
+                'token_counter': 'tiktoken' if encoding else 'estimate',
+                'contexts': self.contexts,
+                'truncated': self.truncated,
+                'average_source_tokens': self.source_tokens / self.contexts if self.contexts else 0.0,
+                'average_context_tokens': self.context_tokens / self.contexts if self.contexts else 0.0
+            }
+
+
+# Shared context builder for the whole process
+context_builder = ContextBuilder()
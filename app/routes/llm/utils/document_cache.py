@@ -0,0 +1,87 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+# Maximum number of prepared incident documents kept in memory
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", 2000))
+
+
+class DocumentCache:
+    """
+    LRU cache of the incident documents keyed by accident_id, serialized and prepared once for the
+    context builder (see PreparedDocument).
+
+    The incident corpus only changes on ingest, so entries stay valid until the ingest
+    generation written by create_dbs.py changes, at which point the cache is cleared.
+    """
+
+    def __init__(self, max_size=DOCUMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.documents = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def check_generation(self, generation):
+        """
+        Clear the cache if the corpus was re-ingested. Must be called with the lock held.
+
+        :param generation: The current ingest generation.
+        """
+        if generation != self.generation:
+            self.documents.clear()
+            self.generation = generation
+
+    def get_many(self, ids, generation):
+        """
+        Get the cached documents of a list of accident IDs.
+
+        :param ids: List of accident IDs.
+        :param generation: The current ingest generation, read by the caller with `ingest_generation.get` or `aget`.
+        :return: Dictionary of the cached prepared documents by accident ID.
+        """
+        found = {}
+        with self.lock:
+            self.check_generation(generation)
+            for id in ids:
+                document = self.documents.get(id)
+                if document is None:
+                    self.misses += 1
+                    continue
+                self.documents.move_to_end(id)
+                self.hits += 1
+                found[id] = document
+        return found
+
+    def put_many(self, documents):
+        """
+        Add prepared documents to the cache.
+
+        :param documents: Dictionary of prepared documents by accident ID.
+        """
+        with self.lock:
+            for id, document in documents.items():
+                self.documents[id] = document
+                self.documents.move_to_end(id)
+            while len(self.documents) > self.max_size:
+                self.documents.popitem(last=False)
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        :return: Dictionary of hit/miss counters and cache size.
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self.documents),
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+# Shared document cache for the whole process
+document_cache = DocumentCache()
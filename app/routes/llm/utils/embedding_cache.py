@@ -0,0 +1,150 @@
+import logging
+import os
+import re
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from langchain_core.embeddings import Embeddings
+
+# Maximum number of query embeddings kept in memory
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+# Path of the SQLite file persisting query embeddings across restarts, empty to disable the disk tier
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+# Maximum number of query embeddings kept on disk
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", 100000))
+# Number of disk insertions between two prunings of the disk tier
+EMBEDDING_CACHE_PRUNE_INTERVAL = 100
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a query so that near-identical questions share the same cache entry.
+
+    :param text: The query.
+    :return: The lower-cased query with collapsed whitespaces and without trailing punctuation.
+    """
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return text.rstrip(' ?!.')
+
+
+class EmbeddingDiskCache:
+    """
+    SQLite backed tier of the embedding cache, surviving restarts.
+    Least recently used entries are pruned once `max_size` is exceeded.
+    """
+
+    def __init__(self, path, model_name, max_size=EMBEDDING_CACHE_DISK_SIZE):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.inserts = 0
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, query))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+
+    def get(self, query):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND query = ?", (self.model_name, query)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND query = ?", (time.time(), self.model_name, query)
+            )
+            self.connection.commit()
+        vector = array('f')
+        vector.frombytes(row[0])
+        return vector
+
+    def put(self, query, vector):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO embeddings (model, query, vector, last_used) VALUES (?, ?, ?, ?)",
+                (self.model_name, query, vector.tobytes(), time.time())
+            )
+            self.inserts += 1
+            if self.inserts % EMBEDDING_CACHE_PRUNE_INTERVAL == 0:
+                self.connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,)
+                )
+            self.connection.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper caching query embeddings by normalized text.
+
+    Query embeddings are kept in an in-memory LRU of `max_size` entries, backed by an
+    optional SQLite tier. Document embeddings are not cached and delegated as is.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_size=EMBEDDING_CACHE_SIZE, disk_path=EMBEDDING_CACHE_PATH):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = EmbeddingDiskCache(disk_path, model_name)
+            except sqlite3.Error as e:
+                logging.error(f'Failed to open the embedding disk cache {disk_path}: {e}')
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_text(text)
+        with self.lock:
+            vector = self.cache.get(key)
+            if vector is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+
+        vector = self.disk.get(key) if self.disk is not None else None
+        disk_hit = vector is not None
+        if not disk_hit:
+            # Embed the normalized text so that every query sharing the key gets the same vector
+            vector = array('f', self.embeddings.embed_query(key))
+            if self.disk is not None:
+                self.disk.put(key, vector)
+
+        with self.lock:
+            if disk_hit:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            self.cache[key] = vector
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return vector.tolist()
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        :return: Dictionary of hit/miss counters and cache size.
+        """
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self.cache),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0
+        }
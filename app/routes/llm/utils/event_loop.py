@@ -0,0 +1,84 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+# Number of threads running the CPU-bound steps (embedding, reranking...) offloaded from the background loop
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", 4))
+
+
+class BackgroundEventLoop:
+    """
+    Event loop running forever in a daemon thread.
+
+    Flask runs each async view in a fresh event loop that is closed when the view
+    returns, so async clients bound to it (HTTP connection pools to the LLM provider,
+    async database drivers...) can never be reused by the next request. Coroutines
+    submitted here all run on the same long-lived loop, so these clients keep their
+    connections alive across requests.
+    """
+
+    def __init__(self, name="llm-event-loop"):
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self.lock = Lock()
+
+    def get_loop(self):
+        """
+        Get the background event loop, starting its thread on first use.
+
+        :return: The running asyncio event loop.
+        """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = Thread(target=self.loop.run_forever, name=self.name, daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the background loop.
+
+        :param coro: The coroutine to run.
+        :return: A concurrent.futures.Future holding the coroutine result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the background loop and block until it completes.
+
+        :param coro: The coroutine to run.
+        :param timeout: Maximum number of seconds to wait, None to wait forever.
+        :return: The coroutine result.
+        """
+        return self.submit(coro).result(timeout)
+
+    async def wrap(self, coro):
+        """
+        Run a coroutine on the background loop from another event loop.
+
+        :param coro: The coroutine to run.
+        :return: The coroutine result.
+        """
+        return await asyncio.wrap_future(self.submit(coro))
+
+
+# Shared background event loop for the whole process
+background_loop = BackgroundEventLoop()
+
+# Bounded pool of the CPU-bound work of the coroutines running on the background loop, so
+# that many in-flight requests never run more than COMPUTE_WORKERS model inferences at once
+compute_executor = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix="compute")
+
+
+async def offload(func, *args):
+    """
+    Run a blocking function in the compute executor without blocking the running event loop.
+
+    :param func: The function to run.
+    :return: The function result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(compute_executor, func, *args)
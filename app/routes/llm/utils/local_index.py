@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+from typing import List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from .event_loop import offload
+
+# Files of a local index folder, written by create_dbs.py:
+# - vectors.npy: float32 matrix of the L2-normalized document embeddings, one row per document.
+# - metadata.json: {"model": embeddings model name, "documents": [{"uuid", "incident_id", "industry", "event", "source", "text"}, ...]}
+#   with one entry per row of the matrix.
+# - ivf.npz: inverted file (coarse k-means clustering) trained by the application when IVF search is enabled.
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "metadata.json"
+IVF_FILE = "ivf.npz"
+
+# Number of k-means iterations used to train the inverted file
+IVF_TRAINING_ITERATIONS = 10
+
+
+def normalize(vectors):
+    """
+    L2-normalize vectors so that the dot product is the cosine similarity.
+
+    :param vectors: A vector or a matrix of row vectors.
+    :return: The normalized vector(s) as float32.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def maximal_marginal_relevance(query_vector, vectors, k, lambda_mult=0.5):
+    """
+    Select the vectors maximizing the marginal relevance to the query.
+
+    :param query_vector: Normalized query vector.
+    :param vectors: Matrix of normalized candidate vectors.
+    :param k: Number of vectors to select.
+    :param lambda_mult: Trade-off between relevance (1) and diversity (0).
+    :return: List of the selected row indices of `vectors`, in selection order.
+    """
+    if len(vectors) == 0 or k <= 0:
+        return []
+    relevance = vectors @ query_vector
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of each candidate to the already selected vectors
+    redundancy = vectors @ vectors[selected[0]]
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+
+class LocalVectorIndex:
+    """
+    Embedded vector index of the incidents, an alternative to the Weaviate server.
+
+    The embeddings matrix is memory-mapped, search is either exact (dot product against
+    every candidate) or IVF (only the rows of the `n_probe` closest k-means clusters are
+    scored). Documents can be pre-filtered by industry before scoring.
+    """
+
+    def __init__(self, folder, n_lists=0, n_probe=8):
+        self.folder = folder
+        self.vectors = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode='r')
+        with open(os.path.join(folder, METADATA_FILE), encoding='utf-8') as file:
+            metadata = json.load(file)
+        self.model = metadata.get("model")
+        self.documents = metadata["documents"]
+        if len(self.documents) != len(self.vectors):
+            raise ValueError(f"Local index {folder} is inconsistent: {len(self.vectors)} vectors for {len(self.documents)} documents")
+        # Metadata columns used for filtering
+        self.industries = np.array([document["industry"] for document in self.documents], dtype=object)
+
+        self.n_probe = n_probe
+        self.centroids = None
+        self.assignments = None
+        if n_lists > 0 and len(self.vectors) > n_lists:
+            self.load_ivf(n_lists)
+
+    def load_ivf(self, n_lists):
+        """
+        Load the inverted file, training (and saving) it if missing or outdated.
+
+        :param n_lists: Number of k-means clusters.
+        """
+        path = os.path.join(self.folder, IVF_FILE)
+        vectors_mtime = os.path.getmtime(os.path.join(self.folder, VECTORS_FILE))
+        if os.path.exists(path):
+            ivf = np.load(path)
+            if len(ivf["centroids"]) == n_lists and int(ivf["n_vectors"]) == len(self.vectors) \
+                    and float(ivf["vectors_mtime"]) == vectors_mtime:
+                self.centroids = ivf["centroids"]
+                self.assignments = ivf["assignments"]
+                return
+
+        logging.info(f'Training local index IVF with {n_lists} lists over {len(self.vectors)} vectors')
+        self.centroids, self.assignments = self.train_ivf(n_lists)
+        np.savez(path, centroids=self.centroids, assignments=self.assignments,
+                 n_vectors=len(self.vectors), vectors_mtime=vectors_mtime)
+
+    def train_ivf(self, n_lists):
+        """
+        Cluster the vectors with spherical k-means.
+
+        :param n_lists: Number of clusters.
+        :return: The (centroids, assignments) pair.
+        """
+        vectors = np.asarray(self.vectors)
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(IVF_TRAINING_ITERATIONS):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = vectors[assignments == list_id]
+                if len(members):
+                    centroids[list_id] = members.sum(axis=0)
+            centroids = normalize(centroids)
+        return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+    def candidates(self, query_vector, industries=None):
+        """
+        Rows that may match a query: those of the closest IVF lists (every row in exact mode)
+        belonging to one of the industries.
+
+        :param query_vector: Normalized query vector.
+        :param industries: List of industries to keep, None or 'all' to keep every industry.
+        :return: Array of row indices.
+        """
+        mask = np.ones(len(self.vectors), dtype=bool)
+        if industries is not None and industries != 'all':
+            mask &= np.isin(self.industries, list(industries))
+        if self.centroids is not None:
+            probed = np.argsort(self.centroids @ query_vector)[::-1][:self.n_probe]
+            mask &= np.isin(self.assignments, probed)
+        return np.flatnonzero(mask)
+
+    def search(self, query_vector, k, industries=None):
+        """
+        Find the rows most similar to a query.
+
+        :param query_vector: Query vector.
+        :param k: Number of rows to return.
+        :param industries: List of industries to keep, None or 'all' to keep every industry.
+        :return: List of (row, cosine similarity) pairs, most similar first.
+        """
+        query_vector = normalize(query_vector)
+        rows = self.candidates(query_vector, industries)
+        if len(rows) == 0:
+            return []
+        scores = self.vectors[rows] @ query_vector
+        best = np.argsort(scores)[::-1][:k]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def max_marginal_relevance_search(self, query_vector, k=4, fetch_k=20, lambda_mult=0.5, industries=None):
+        """
+        Find the `fetch_k` rows most similar to a query, then select `k` of them by maximal marginal relevance.
+
+        :return: List of rows in selection order.
+        """
+        query_vector = normalize(query_vector)
+        rows = [row for row, _ in self.search(query_vector, fetch_k, industries)]
+        if not rows:
+            return []
+        selected = maximal_marginal_relevance(query_vector, np.asarray(self.vectors[rows]), k, lambda_mult)
+        return [rows[i] for i in selected]
+
+    def to_document(self, row):
+        """
+        Build the LangChain document of a row, with the same metadata as the Weaviate documents.
+        """
+        document = self.documents[row]
+        return Document(
+            page_content=document["text"],
+            metadata={
+                "incident_id": document["incident_id"],
+                "industry": document["industry"],
+                "event": document["event"],
+                "source": document["source"]
+            }
+        )
+
+
+class LocalIndexRetriever(BaseRetriever):
+    """Retriever searching a LocalVectorIndex, mirroring the Weaviate MMR retriever."""
+
+    index: LocalVectorIndex
+    """Index to search."""
+    embeddings: Embeddings
+    """Embeddings model used to encode queries."""
+    industries: Optional[List[str]] = None
+    """Industries to keep, None to keep every industry."""
+    search_type: str = "mmr"
+    """Either 'mmr' or 'similarity'."""
+    k: int = 4
+    """Number of documents to return."""
+    fetch_k: int = 20
+    """Number of documents fetched before the MMR selection."""
+    lambda_mult: float = 0.5
+    """Trade-off between relevance (1) and diversity (0) of the MMR selection."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        query_vector = self.embeddings.embed_query(query)
+        if self.search_type == "mmr":
+            rows = self.index.max_marginal_relevance_search(query_vector, self.k, self.fetch_k, self.lambda_mult, self.industries)
+        else:
+            rows = [row for row, _ in self.index.search(query_vector, self.k, self.industries)]
+        return [self.index.to_document(row) for row in rows]
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return await offload(self._get_relevant_documents, query)
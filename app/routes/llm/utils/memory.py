@@ -1,24 +1,173 @@
-from collections import defaultdict 
+import json
+import os
+import time
+from collections import OrderedDict, deque
 from threading import Lock
 from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, messages_from_dict, messages_to_dict
+
+# Backend storing the conversation windows: 'local' (worker memory) or 'redis' (shared by all workers)
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "local")
+# Number of exchanges (question and answer) kept in each conversation window
+MEMORY_WINDOW_SIZE = int(os.getenv("MEMORY_WINDOW_SIZE", 5))
+# Maximum number of conversations kept by a worker
+MEMORY_MAX_CHATS = int(os.getenv("MEMORY_MAX_CHATS", 1000))
+# Number of seconds of inactivity after which a conversation is dropped
+MEMORY_TTL = int(os.getenv("MEMORY_TTL", 24 * 3600))
+
+
+# Convert chat history entries ({'role': 'user' | 'model', 'parts': text}) into messages,
+# skipping the messages without text (answers still pending or failed)
+def history_to_messages(history):
+    return [
+        HumanMessage(content=entry['parts']) if entry['role'] == 'user' else AIMessage(content=entry['parts'])
+        for entry in history
+        if entry['parts']
+    ]
+
+
+# Chat history kept in the worker memory, bounded to the last messages of the window
+class WindowChatMessageHistory(BaseChatMessageHistory):
+
+    def __init__(self, max_messages):
+        self.window = deque(maxlen=max_messages)
+
+    @property
+    def messages(self):
+        return list(self.window)
+
+    def add_message(self, message):
+        self.window.append(message)
+
+    def clear(self):
+        self.window.clear()
+
+    def replace(self, messages):
+        self.window.clear()
+        self.window.extend(messages)
+
+
+# Chat history stored in a Redis list, trimmed to the last messages of the window
+# and expiring after `ttl` seconds of inactivity
+class RedisWindowChatMessageHistory(BaseChatMessageHistory):
+    KEY_PREFIX = "incident_navigator:memory:"
+
+    def __init__(self, redis_client, key, max_messages, ttl):
+        self.redis = redis_client
+        self.key = self.KEY_PREFIX + key
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @property
+    def messages(self):
+        items = self.redis.lrange(self.key, 0, -1)
+        return messages_from_dict([json.loads(item) for item in items])
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def add_messages(self, messages):
+        # Append, trim and refresh the expiration in a single round trip
+        pipeline = self.redis.pipeline()
+        pipeline.rpush(self.key, *[json.dumps(item) for item in messages_to_dict(messages)])
+        pipeline.ltrim(self.key, -self.max_messages, -1)
+        pipeline.expire(self.key, self.ttl)
+        pipeline.execute()
+
+    def clear(self):
+        self.redis.delete(self.key)
+
+    def replace(self, messages):
+        # Replace the whole window in a single transaction, so that workers rebuilding
+        # the same window concurrently never interleave their messages
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.delete(self.key)
+        if messages:
+            pipeline.rpush(self.key, *[json.dumps(item) for item in messages_to_dict(messages)])
+            pipeline.ltrim(self.key, -self.max_messages, -1)
+            pipeline.expire(self.key, self.ttl)
+        pipeline.execute()
+
+
+# Memory of a single conversation with its own lock
+class ChatMemory:
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.lock = Lock()
+        self.last_access = time.monotonic()
+
 
 # Define a class to manage conversation memories
 class MemoryManager:
-    
+
     # Initialize the MemoryManager object
-    def __init__(self):
-        # The 'user_chat_memories' is a defaultdict of defaultdicts, 
-        # where the outer defaultdict uses user IDs and the inner defaultdict stores 
-        # ConversationBufferWindowMemory instances keyed by chat IDs.
-        self.user_chat_memories = defaultdict(
-            lambda: defaultdict(ConversationBufferWindowMemory))  
-        
-        # A Lock object to synchronize access to the memory in a multi-threaded environment.
+    def __init__(self, redis_client=None, window_size=MEMORY_WINDOW_SIZE, max_chats=MEMORY_MAX_CHATS, ttl=MEMORY_TTL):
+        # When a Redis client is given the conversation windows are persisted in Redis,
+        # otherwise they only live in this worker.
+        self.redis = redis_client
+        self.window_size = window_size
+        self.max_chats = max_chats
+        self.ttl = ttl
+
+        # The 'chat_memories' is an OrderedDict of ChatMemory keyed by (user ID, chat ID),
+        # ordered from the least to the most recently used.
+        self.chat_memories = OrderedDict()
+
+        # A Lock object guarding the 'chat_memories' index only, each conversation has its own lock.
         self.lock = Lock()
 
-    # Method to retrieve memory for a specific user and chat.
-    def get_memory(self, user_id, chat_id):
-        # Use the lock to ensure that only one thread accesses this section at a time.
+    # Method to create the memory of a chat.
+    def create_memory(self, user_id, chat_id):
+        max_messages = 2 * self.window_size
+        if self.redis is not None:
+            history = RedisWindowChatMessageHistory(self.redis, f"{user_id}:{chat_id}", max_messages, self.ttl)
+        else:
+            history = WindowChatMessageHistory(max_messages)
+        return ChatMemory(ConversationBufferWindowMemory(k=self.window_size, chat_memory=history))
+
+    # Method to drop the conversations inactive for longer than the TTL, must be called with the lock held.
+    def evict_expired(self, now):
+        while self.chat_memories:
+            key, chat_memory = next(iter(self.chat_memories.items()))
+            if now - chat_memory.last_access < self.ttl:
+                break
+            self.chat_memories.pop(key)
+
+    # Method to retrieve the ChatMemory of a specific user and chat.
+    def get_chat_memory(self, user_id, chat_id):
+        key = (user_id, chat_id)
+        now = time.monotonic()
         with self.lock:
-            # Return the ConversationBufferWindowMemory object for the specified user and chat.
-            return self.user_chat_memories[user_id][chat_id]
+            self.evict_expired(now)
+            chat_memory = self.chat_memories.get(key)
+            if chat_memory is None:
+                chat_memory = self.create_memory(user_id, chat_id)
+                self.chat_memories[key] = chat_memory
+                # Evict the least recently used conversations
+                while len(self.chat_memories) > self.max_chats:
+                    self.chat_memories.popitem(last=False)
+            else:
+                self.chat_memories.move_to_end(key)
+            chat_memory.last_access = now
+            return chat_memory
+
+    # Method to retrieve memory for a specific user and chat.
+    # When 'history', the last persisted messages of the chat, is given, the database is
+    # authoritative: the window is rebuilt from it on every turn, so that turns served by
+    # other workers (or lost by a restart) are always taken into account.
+    def get_memory(self, user_id, chat_id, history=None):
+        chat_memory = self.get_chat_memory(user_id, chat_id)
+        if history is not None:
+            with chat_memory.lock:
+                chat_memory.memory.chat_memory.replace(history_to_messages(history[-2 * self.window_size:]))
+        # Return the ConversationBufferWindowMemory object for the specified user and chat.
+        return chat_memory.memory
+
+    # Method to add a question and its answer to the memory of a chat.
+    def add_interaction(self, user_id, chat_id, question, answer):
+        chat_memory = self.get_chat_memory(user_id, chat_id)
+        # Use the chat lock so that concurrent interactions of a chat are not interleaved.
+        with chat_memory.lock:
+            chat_memory.memory.chat_memory.add_messages([HumanMessage(content=question), AIMessage(content=answer)])
@@ -0,0 +1,195 @@
+import logging
+import os
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+import numpy as np
+from flashrank import RerankRequest
+
+# Maximum number of (query, passage) pairs scored in one ONNX pass, 0 to rerank each request on its own
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 128))
+# Number of milliseconds the worker waits for other requests to join a batch
+RERANK_BATCH_WAIT_MS = float(os.getenv("RERANK_BATCH_WAIT_MS", 5))
+
+
+def supports_batching(client):
+    """
+    Whether the pairs of several queries can be scored in one pass of the Flashrank client session.
+    Only the cross-encoder models expose a tokenizer and an ONNX session, listwise LLM models do not.
+
+    :param client: The Flashrank Ranker.
+    """
+    return (
+        not hasattr(client, "llm_model")
+        and getattr(client, "session", None) is not None
+        and getattr(client, "tokenizer", None) is not None
+    )
+
+
+def score_requests(client, requests):
+    """
+    Score the passages of several queries.
+
+    With a cross-encoder model every (query, passage) pair is tokenized and scored in a single
+    ONNX pass, with the same tokenization and sigmoid as Flashrank. Otherwise each query is
+    reranked by the client on its own.
+
+    :param client: The Flashrank Ranker.
+    :param requests: List of (query, passage texts) pairs.
+    :return: List of the passage scores of each request, in the passages order.
+    """
+    if not supports_batching(client):
+        results = []
+        for query, texts in requests:
+            passages = [{"id": i, "text": text} for i, text in enumerate(texts)]
+            scores = [0.0] * len(texts)
+            for passage in client.rerank(RerankRequest(query=query, passages=passages)):
+                scores[passage["id"]] = float(passage["score"])
+            results.append(scores)
+        return results
+
+    pairs = [[query, text] for query, texts in requests for text in texts]
+    encodings = client.tokenizer.encode_batch(pairs)
+    onnx_input = {
+        "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+        "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+    }
+    token_type_ids = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+    if np.any(token_type_ids):
+        onnx_input["token_type_ids"] = token_type_ids
+    logits = client.session.run(None, onnx_input)[0]
+    if logits.shape[1] == 1:
+        scores = 1 / (1 + np.exp(-logits.flatten()))
+    else:
+        exp_logits = np.exp(logits)
+        scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+
+    results = []
+    start = 0
+    for _, texts in requests:
+        results.append([float(score) for score in scores[start:start + len(texts)]])
+        start += len(texts)
+    return results
+
+
+class RerankBatcher:
+    """
+    Reranking worker shared by the concurrent requests of a process.
+
+    Rather than running one small ONNX inference per request, the worker thread collects the
+    (query, passages) requests arriving within `wait` seconds of the first one, up to
+    `batch_size` pairs, scores them in a single pass and hands each request its scores back.
+    """
+
+    def __init__(self, client, batch_size=RERANK_BATCH_SIZE, wait=RERANK_BATCH_WAIT_MS / 1000):
+        self.client = client
+        self.batch_size = batch_size
+        self.wait = wait
+        self.queue = queue.Queue()
+        self.thread = None
+        self.batches = 0
+        self.requests = 0
+        self.pairs = 0
+        self.wait_time = 0.0
+        self.inference_time = 0.0
+        self.lock = Lock()
+
+    def start(self):
+        """
+        Start the worker thread if not running yet.
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name="rerank-batcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, query, texts):
+        """
+        Queue the passages of a query for scoring.
+
+        :param query: The query.
+        :param texts: List of passage texts.
+        :return: A concurrent.futures.Future holding the list of scores, in the passages order.
+        """
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self.start()
+        self.queue.put((query, texts, future, time.monotonic()))
+        return future
+
+    def score(self, query, texts):
+        """
+        Score the passages of a query, blocking until the batch holding them is scored.
+
+        :param query: The query.
+        :param texts: List of passage texts.
+        :return: List of scores, in the passages order.
+        """
+        return self.submit(query, texts).result()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            pairs = len(batch[0][1])
+            deadline = time.monotonic() + self.wait
+            # Collect the requests arriving within the wait time, until the batch is full
+            while pairs < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                pairs += len(request[1])
+            self.run_batch(batch, pairs)
+
+    def run_batch(self, batch, pairs):
+        """
+        Score a batch of requests and resolve their futures.
+
+        :param batch: List of (query, texts, future, enqueue time) requests.
+        :param pairs: Number of (query, passage) pairs of the batch.
+        """
+        start = time.monotonic()
+        try:
+            results = score_requests(self.client, [(query, texts) for query, texts, _, _ in batch])
+        except Exception as e:
+            logging.error(f'Failed to rerank a batch of {len(batch)} requests: {e}')
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        end = time.monotonic()
+        with self.lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.pairs += pairs
+            self.wait_time += sum(start - enqueued for _, _, _, enqueued in batch)
+            self.inference_time += end - start
+        for (_, _, future, _), scores in zip(batch, results):
+            future.set_result(scores)
+
+    def stats(self):
+        """
+        Get the throughput statistics of the worker.
+
+        :return: Dictionary of the batch counters and averages.
+        """
+        with self.lock:
+            return {
+                'batch_size': self.batch_size,
+                'wait_ms': self.wait * 1000,
+                'batched_inference': supports_batching(self.client),
+                'batches': self.batches,
+                'requests': self.requests,
+                'pairs': self.pairs,
+                'requests_per_batch': self.requests / self.batches if self.batches else 0.0,
+                'pairs_per_batch': self.pairs / self.batches if self.batches else 0.0,
+                'average_wait_ms': 1000 * self.wait_time / self.requests if self.requests else 0.0,
+                'average_inference_ms': 1000 * self.inference_time / self.batches if self.batches else 0.0,
+                'pairs_per_second': self.pairs / self.inference_time if self.inference_time else 0.0
+            }
@@ -1,8 +1,13 @@
+import asyncio
 from langchain_core.documents import Document
 from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
-from flashrank import Ranker, RerankRequest
+from flashrank import Ranker
 from typing import Optional
 from pydantic import model_validator
+from .event_loop import offload
+from .rerank_batcher import RERANK_BATCH_SIZE, RerankBatcher, score_requests
+from .score_cache import rerank_score_cache
+from ...mongo import ingest_generation
 
 class CustomReranker(BaseDocumentCompressor):
     """Document compressor using Flashrank interface."""
@@ -13,6 +18,8 @@ class CustomReranker(BaseDocumentCompressor):
     """Number of documents to return."""
     model: Optional[str] = None
     """Model to use for reranking."""
+    batcher: Optional[RerankBatcher] = None
+    """Worker scoring the passages of concurrent requests together, None to rerank each request on its own."""
 
     class Config:
         extra = 'forbid'
@@ -29,25 +36,95 @@ class CustomReranker(BaseDocumentCompressor):
                 "Please install it with `pip install flashrank`."
             )
 
-        values["model"] = values.get("model", "ms-marco-MiniLM-L-12-v2")
-        values["client"] = Ranker(model_name=values["model"], cache_dir="reranker")
+        values["model"] = values.get("model") or "ms-marco-MiniLM-L-12-v2"
+        # Reuse an already loaded Flashrank client when one is given, loading the
+        # ONNX model is by far the most expensive part of building a reranker.
+        if values.get("client") is None:
+            values["client"] = Ranker(model_name=values["model"], cache_dir="reranker")
+        if values.get("batcher") is None and RERANK_BATCH_SIZE > 0:
+            values["batcher"] = RerankBatcher(values["client"])
         return values
 
-    def compress_documents(self, documents, query, callbacks = None):
-        passages = [
-            {"id": i, "text": doc.page_content, "metadata": doc.metadata} for i, doc in enumerate(documents)
-        ]
-        rerank_request = RerankRequest(query=query, passages=passages)
-        rerank_response = self.client.rerank(rerank_request)[:self.top_n]
-        final_results = []
-        for r in rerank_response:
-            doc = Document(
-                page_content=r["text"],
+    def stats(self):
+        """Get the throughput statistics of the reranking worker, None when batching is disabled."""
+        return self.batcher.stats() if self.batcher is not None else None
+
+    def lookup(self, documents, query, generation):
+        """
+        Read the scores of the documents already computed for a query from the score cache.
+
+        :param documents: List of documents.
+        :param query: The standalone query.
+        :param generation: The current ingest generation.
+        :return: Tuple of the incident IDs of the documents, the cached scores by incident ID
+            and the indices of the documents left to score.
+        """
+        incident_ids = [doc.metadata.get("incident_id") for doc in documents]
+        cached = rerank_score_cache.get_many(query, [id for id in incident_ids if id is not None], generation)
+        missing = [i for i, id in enumerate(incident_ids) if id is None or id not in cached]
+        return incident_ids, cached, missing
+
+    @staticmethod
+    def merge(query, incident_ids, cached, missing, computed):
+        """
+        Cache the computed scores and merge them with the cached ones.
+
+        :return: List of scores, in the documents order.
+        """
+        rerank_score_cache.put_many(
+            query, {incident_ids[i]: score for i, score in zip(missing, computed) if incident_ids[i] is not None}
+        )
+        scores = [cached.get(id) for id in incident_ids]
+        for i, score in zip(missing, computed):
+            scores[i] = score
+        return scores
+
+    def score(self, documents, query):
+        """
+        Score the relevance of documents to a query, reading the scores already computed from the score cache.
+
+        :param documents: List of documents.
+        :param query: The standalone query.
+        :return: List of scores, in the documents order.
+        """
+        incident_ids, cached, missing = self.lookup(documents, query, ingest_generation.get())
+        texts = [documents[i].page_content for i in missing]
+        if self.batcher is not None:
+            computed = self.batcher.score(query, texts)
+        else:
+            computed = score_requests(self.client, [(query, texts)])[0] if texts else []
+        return self.merge(query, incident_ids, cached, missing, computed)
+
+    async def ascore(self, documents, query):
+        """
+        Score the relevance of documents to a query like `score`, without blocking the event loop:
+        the batching worker is awaited, the unbatched scoring runs in the compute executor.
+        """
+        if self.batcher is None:
+            return await offload(self.score, documents, query)
+        incident_ids, cached, missing = self.lookup(documents, query, await ingest_generation.aget())
+        computed = await asyncio.wrap_future(self.batcher.submit(query, [documents[i].page_content for i in missing]))
+        return self.merge(query, incident_ids, cached, missing, computed)
+
+    def select(self, documents, scores):
+        """
+        Keep the `top_n` documents with the highest scores, best first.
+        """
+        ranked = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:self.top_n]
+        return [
+            Document(
+                page_content=documents[i].page_content,
                 metadata={
-                    **r['metadata'],
-                    "id": r["id"],
-                    "relevance_score": r["score"]
+                    **documents[i].metadata,
+                    "id": i,
+                    "relevance_score": scores[i]
                 },
             )
-            final_results.append(doc)
-        return final_results
+            for i in ranked
+        ]
+
+    def compress_documents(self, documents, query, callbacks = None):
+        return self.select(documents, self.score(documents, query))
+
+    async def acompress_documents(self, documents, query, callbacks = None):
+        return self.select(documents, await self.ascore(documents, query))
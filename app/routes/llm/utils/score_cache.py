@@ -0,0 +1,100 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from .embedding_cache import normalize_text
+
+# Maximum number of (query, incident) relevance scores kept in memory, 0 to disable the cache
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 20000))
+
+
+class RerankScoreCache:
+    """
+    LRU cache of the reranker relevance scores keyed by (normalized query, incident id).
+
+    Repeated or near-repeated standalone questions retrieve the same incidents, whose scores
+    are then read from the cache instead of being computed again by Flashrank. The passage
+    of an incident only changes on ingest, so the cache is cleared when the ingest generation
+    written by create_dbs.py changes.
+    """
+
+    def __init__(self, max_size=RERANK_CACHE_SIZE):
+        self.max_size = max_size
+        self.scores = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def check_generation(self, generation):
+        """
+        Clear the cache if the corpus was re-ingested. Must be called with the lock held.
+
+        :param generation: The current ingest generation.
+        """
+        if generation != self.generation:
+            self.scores.clear()
+            self.generation = generation
+
+    def get_many(self, query, incident_ids, generation):
+        """
+        Get the cached scores of the incidents for a query.
+
+        :param query: The standalone query.
+        :param incident_ids: List of incident IDs.
+        :param generation: The current ingest generation, read by the caller with `ingest_generation.get` or `aget`.
+        :return: Dictionary of the cached scores by incident ID.
+        """
+        if self.max_size <= 0:
+            return {}
+        query = normalize_text(query)
+        found = {}
+        with self.lock:
+            self.check_generation(generation)
+            for incident_id in incident_ids:
+                key = (query, incident_id)
+                score = self.scores.get(key)
+                if score is None:
+                    self.misses += 1
+                    continue
+                self.scores.move_to_end(key)
+                self.hits += 1
+                found[incident_id] = score
+        return found
+
+    def put_many(self, query, scores):
+        """
+        Add the scores of incidents for a query to the cache.
+
+        :param query: The standalone query.
+        :param scores: Dictionary of scores by incident ID.
+        """
+        if self.max_size <= 0:
+            return
+        query = normalize_text(query)
+        with self.lock:
+            for incident_id, score in scores.items():
+                key = (query, incident_id)
+                self.scores[key] = score
+                self.scores.move_to_end(key)
+            while len(self.scores) > self.max_size:
+                self.scores.popitem(last=False)
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        :return: Dictionary of hit/miss counters and cache size.
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self.scores),
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+# Shared reranker score cache for the whole process
+rerank_score_cache = RerankScoreCache()
@@ -23,6 +23,33 @@ if not SECRET_KEY:
 
 cipher_suite = Fernet(SECRET_KEY)
 
+# Callbacks called each time an LLM configuration is modified
+change_listeners = []
+
+def on_llm_config_change(callback):
+    """
+    Registers a callback called (without arguments) each time an LLM configuration is
+    added, modified, selected or deleted, so that cached clients can be invalidated.
+
+    Args:
+        callback (callable): The function to call.
+
+    Returns:
+        callable: The registered callback.
+    """
+    change_listeners.append(callback)
+    return callback
+
+def notify_llm_config_change():
+    """
+    Calls every registered LLM configuration change callback.
+    """
+    for callback in change_listeners:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Error in LLM configuration change callback: {e}")
+
 def get_uuid():
     """
     Generates a unique identifier using UUID4.
@@ -135,6 +162,9 @@ class LLMConfig(db.Model):
         self.uri = new_uri
         self.updated_at = datetime.datetime.now()
         db.session.commit()
+        # Only the selected configuration is in use
+        if self.selected:
+            notify_llm_config_change()
 
     def update_api_key(self, new_api_key):
         """
@@ -146,6 +176,8 @@ class LLMConfig(db.Model):
         self.api_key_encrypted = self._encrypt_api_key(new_api_key)
         self.updated_at = datetime.datetime.now()
         db.session.commit()
+        if self.selected:
+            notify_llm_config_change()
 
     @staticmethod
     def add_llm(uri, api_key, model, selected):
@@ -168,6 +200,8 @@ class LLMConfig(db.Model):
         new_llm = LLMConfig(uri=uri, api_key=api_key, model=model, selected=selected)
         db.session.add(new_llm)
         db.session.commit()
+        if selected:
+            notify_llm_config_change()
 
         return {'error': 0, 'message': 'LLM model added', 'data': new_llm.to_dict()}, 201
 
@@ -186,8 +220,11 @@ class LLMConfig(db.Model):
         if not llm_model:
             return {'error': 1, 'message': 'LLM model not found', 'data': None}, 404
 
+        selected = llm_model.selected
         db.session.delete(llm_model)
         db.session.commit()
+        if selected:
+            notify_llm_config_change()
 
         return {'error': 0, 'message': 'LLM model deleted', 'data': None}, 200
 
@@ -206,6 +243,7 @@ class LLMConfig(db.Model):
         for llm in all_llms:
             llm.selected = (llm.id == id)
         db.session.commit()
+        notify_llm_config_change()
         return {'error': 0, 'message': 'LLM configuration selected', 'data': id}, 200
 
     @staticmethod
@@ -223,3 +261,16 @@ class LLMConfig(db.Model):
             'api_key': selected_llm._decrypt_api_key()
         }
         return config
+
+    @staticmethod
+    def get_selected_version():
+        """
+        Retrieves the version of the currently selected LLM configuration, without decrypting its API key.
+
+        Returns:
+            tuple or None: The (id, updated_at) pair of the selected LLM, None if no LLM is selected.
+        """
+        selected_llm = db.session.query(LLMConfig.id, LLMConfig.updated_at).filter_by(selected=True).first()
+        if selected_llm is None:
+            return None
+        return (selected_llm.id, selected_llm.updated_at)
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import unittest
+
+# circuit_breaker only depends on the standard library, import it without the Flask packages above it
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "routes", "llm", "utils"))
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def open_breaker():
+    """Create a breaker opened by a failure, whose reset timeout has elapsed: the next call is a trial."""
+    breaker = CircuitBreaker("test", timeout=5, failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    return breaker
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_cancelled_trial_reopens_the_circuit(self):
+        breaker = open_breaker()
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+
+        trial = asyncio.create_task(breaker.acall(hang))
+        await started.wait()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        trial.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await trial
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.failures, 1)
+
+        async def succeed():
+            return "ok"
+
+        # The next call is let through as a new trial and closes the circuit
+        self.assertEqual(await breaker.acall(succeed), "ok")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_failed_trial_opens_the_circuit(self):
+        breaker = open_breaker()
+
+        async def fail():
+            raise ConnectionError("down")
+
+        with self.assertRaises(ConnectionError):
+            await breaker.acall(fail)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        breaker.reset_timeout = 60
+        with self.assertRaises(CircuitOpenError):
+            await breaker.acall(fail)
+
+    def test_interrupted_sync_trial_reopens_the_circuit(self):
+        breaker = open_breaker()
+
+        def interrupt():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            breaker.call(interrupt)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,7 +5,7 @@ import ChatHeader from './components/ChatHeader';
 import ChatView from './components/ChatView';
 import ChatInput from './components/ChatInput';
 import ChatTickets from './components/ChatTickets';
-import { getListMessages, sendMessage, renameChat, chatInfo } from '@/scripts/chat';
+import { getListMessages, sendMessageStream, renameChat, chatInfo } from '@/scripts/chat';
 import { AuthContext } from '../../components/auth/AuthContext';
 
 
@@ -58,9 +58,17 @@ export default function ChatPage({ chatId }) {
             setListMessages([...previousMessages, { source: 'model', status: 0, parts: { answer: "Responding...", references: [] } }]);
             abortControllerRef.current = new AbortController()
 
-            sendMessage(chatId, postMessage, industries, abortControllerRef.current.signal)
-                .then(async (response) => {
-                    const jsonResponse = await response.json();
+            // Display the answer while it is being generated
+            let answer = '';
+            const onEvent = (event, data) => {
+                if (event === 'token') {
+                    answer += data.text;
+                    setListMessages([...previousMessages, { source: 'model', status: 1, parts: { answer: answer, references: [] } }]);
+                }
+            };
+
+            sendMessageStream(chatId, postMessage, industries, abortControllerRef.current.signal, onEvent)
+                .then((jsonResponse) => {
                     setListMessages([...previousMessages, jsonResponse?.data]);
                 })
                 .catch((error) => {
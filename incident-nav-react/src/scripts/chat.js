@@ -112,6 +112,56 @@ async function sendMessage(chat_id, message, industries, abortSignal) {
         });
 }
 
+async function sendMessageStream(chat_id, message, industries, abortSignal, onEvent) {
+    const response = await fetchWithToken(`/chat/send`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'Authorization': `Bearer ${sessionStorage.getItem('token')}`
+            },
+            signal: abortSignal,
+            body: JSON.stringify({ chat_id : chat_id, message: message, industries: industries, stream: true })
+        });
+
+    // Errors before the stream starts are returned as plain JSON
+    if (!response.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+        return await response.json();
+    }
+
+    // Parse the Server-Sent Events: 'token', 'references' then 'done'
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    let result = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += value;
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            const parsed = JSON.parse(data);
+            if (event === 'done') {
+                result = parsed;
+            }
+            onEvent(event, parsed);
+        }
+    }
+    return result;
+}
+
 async function renameChat(chat_id, name) {
     const response = await fetchWithToken(`/chat/rename`, {
         method: 'PUT',
@@ -145,4 +195,4 @@ async function chatInfo(chat_id) {
     return await response.json();
 }
 
-export { newChat, delChat, listChats, getListMessages, sendMessage, renameChat, chatInfo }
\ No newline at end of file
+export { newChat, delChat, listChats, getListMessages, sendMessage, sendMessageStream, renameChat, chatInfo }
\ No newline at end of file